@@ -1,66 +1,168 @@
 import os
+import time
 import logging
-import traceback
 import certifi
 import uuid
-import redis
 import ssl
 import json
+import hmac
 import gridfs
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from bson.objectid import ObjectId
-from flask import Flask, render_template, jsonify, request, send_from_directory, redirect, url_for, session, Response
-from flask_session import Session
+from flask import Flask, render_template, jsonify, request, send_from_directory, redirect, url_for, session, Response, stream_with_context, copy_current_request_context
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timedelta
 import google.generativeai as genai
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from celery import Celery
 
 # --- IMPORT RANK LOGIC ---
-from rank_system import process_daily_rewards, update_rank_check, get_rank_meta, get_all_ranks_data
+from rank_system import apply_entry_rewards, get_rank_meta, RANK_CATALOG_JSON, RANK_CATALOG_VERSION
+from embedding_cache import EmbeddingCache
+from vector_store import build_vector_search
+from model_router import ModelRouter
+from media_pipeline import store_upload, model_image, UploadTooLarge
+from db_indexes import ensure_indexes, verify_query_plans
+from profile_cache import ProfileCache, PROFILE_PROJECTION
+from session_store import build_redis, LazyRedisSessionInterface
+from instrumentation import (configure_logging, begin_request, current_timings, timed, propagate, model_attempt,
+                             MongoTimer, observe_request, metrics_payload)
+from history_search import search_history
+from vault import export_zip, export_ndjson, import_vault
+from storage_gc import pfp_file_id, collect_files, request_deletion, delete_account_data, stale_deletions, sweep_orphans
+from constellations import group_for, allocate_star_indexes, sync_write, committed_sync_seq, add_star, set_name, constellation_names, rebuild_constellations
 
 # --- SETUP LOGGING ---
-logging.basicConfig(level=logging.DEBUG)
+# Structured (JSON lines) at INFO by default; LOG_FORMAT=text for local runs
+configure_logging(os.environ.get('LOG_LEVEL', 'INFO').upper(), os.environ.get('LOG_FORMAT', 'json'))
+log = logging.getLogger("celi")
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 2000))
 app = Flask(__name__)
 
 # --- CONFIG: SECRET & REDIS ---
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'celi_super_secret_key_999')
-app.config['SESSION_TYPE'] = 'redis'
-app.config['SESSION_PERMANENT'] = False
-app.config['SESSION_USE_SIGNER'] = True
 
 redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379')
 if 'upstash' in redis_url or 'rediss' in redis_url:
     if redis_url.startswith('redis://'): redis_url = redis_url.replace('redis://', 'rediss://', 1)
-    app.config['SESSION_REDIS'] = redis.from_url(redis_url, ssl_cert_reqs=None)
-else:
-    app.config['SESSION_REDIS'] = redis.from_url(redis_url)
+# One sized, health-checked pool shared by sessions, caches and flight locks
+app.config['SESSION_REDIS'] = build_redis(
+    redis_url,
+    max_connections=int(os.environ.get('REDIS_MAX_CONNECTIONS', 20)),
+    timeout=float(os.environ.get('REDIS_TIMEOUT', 5)),
+    health_check_interval=int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30))
+)
 
-server_session = Session(app)
+# --- CONFIG: SESSIONS ---
+# 'redis' (default): server-side, loaded only when a route touches `session`, written only when it changes.
+# 'cookie': stateless signed cookie (the payload is just user_id + awaiting_void_confirm); no Redis on any request.
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'redis')
+if SESSION_BACKEND == 'redis': app.session_interface = LazyRedisSessionInterface(app.config['SESSION_REDIS'])
+
+# --- CONFIG: UPLOAD LIMITS ---
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_MB', 10)) * 1024 * 1024
+MAX_AUDIO_BYTES = int(os.environ.get('MAX_AUDIO_MB', 25)) * 1024 * 1024
+MAX_PFP_BYTES = int(os.environ.get('MAX_PFP_MB', 5)) * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_IMAGE_BYTES + MAX_AUDIO_BYTES + 1024 * 1024
+MAX_IMPORT_BYTES = int(os.environ.get('MAX_IMPORT_MB', 512)) * 1024 * 1024  # /api/import only
+# Images are downscaled/re-encoded before model calls; originals stay in GridFS for display
+MODEL_IMAGE_MAX_SIDE = int(os.environ.get('MODEL_IMAGE_MAX_SIDE', 1024))
+MODEL_IMAGE_QUALITY = int(os.environ.get('MODEL_IMAGE_QUALITY', 80))
+
+# --- CONFIG: CELERY (BACKGROUND JOBS) ---
+broker_url = os.environ.get('CELERY_BROKER_URL', redis_url)
+celery_app = Celery(app.import_name, broker=broker_url)
+celery_app.conf.update(task_ignore_result=True, task_acks_late=True, worker_prefetch_multiplier=1)
+# Publishing happens on the request path: an unreachable broker must fail fast, not sit in kombu's retry loop
+BROKER_PUBLISH_TIMEOUT = float(os.environ.get('BROKER_PUBLISH_TIMEOUT', 2))
+celery_app.conf.update(broker_connection_timeout=BROKER_PUBLISH_TIMEOUT,
+                       broker_transport_options={'socket_connect_timeout': BROKER_PUBLISH_TIMEOUT, 'socket_timeout': BROKER_PUBLISH_TIMEOUT})
+if broker_url.startswith('rediss://'):
+    celery_app.conf.broker_use_ssl = {'ssl_cert_reqs': ssl.CERT_NONE}
 
 # --- CONFIG: MONGODB & GRIDFS ---
 mongo_uri = os.environ.get("MONGO_URI")
-db, users_col, history_col, fs = None, None, None, None
+db, users_col, history_col, constellations_col, fs = None, None, None, None, None
 
 if mongo_uri:
     try:
-        client = MongoClient(mongo_uri, tlsCAFile=certifi.where())
+        client = MongoClient(mongo_uri, tlsCAFile=certifi.where(), event_listeners=[MongoTimer()])
         db = client['celi_journal_db']
         users_col = db['users']
         history_col = db['history']
+        constellations_col = db['constellations']
         fs = gridfs.GridFS(db)
-        print("✅ Memory Core (MongoDB + GridFS + Vectors) Connected")
-    except Exception as e: print(f"❌ Memory Core Error: {e}")
+        log.info("memory core connected (MongoDB + GridFS + vectors)")
+        # Indexes are built by `python db_indexes.py` (Procfile release phase); ENSURE_INDEXES=1 also builds them at boot
+        if os.environ.get('ENSURE_INDEXES', '0') == '1': ensure_indexes(db)
+        if os.environ.get('VERIFY_QUERY_PLANS') == '1': verify_query_plans(db)
+    except Exception as e: log.error("memory core connection failed", extra={"error": str(e)})
+
+# Vector backend: 'atlas' ($vectorSearch), 'local' (NumPy index) or 'auto' (Atlas, local fallback)
+vector_search = build_vector_search(history_col, os.environ.get('VECTOR_BACKEND', 'auto'), os.environ.get('VECTOR_INDEX_DIR')) if history_col is not None else None
 
 # --- CONFIG: AI CORE ---
+def gevent_patched():
+    """True inside a gunicorn gevent worker (sockets already monkey-patched)."""
+    try:
+        from gevent import monkey
+        return monkey.is_module_patched("socket")
+    except ImportError:
+        return False
+
+GEVENT_ACTIVE = gevent_patched()
+# gRPC keeps its own event loop and would block the gevent hub; REST goes through the patched sockets
+GENAI_TRANSPORT = os.environ.get("GENAI_TRANSPORT") or ("rest" if GEVENT_ACTIVE else None)
+
 api_key = os.environ.get("GEMINI_API_KEY")
 if api_key:
     try: 
         # Clean key just in case
         clean_key = api_key.strip().replace("'", "").replace('"', "")
-        genai.configure(api_key=clean_key)
-        print("✅ Gemini AI Core Connected")
+        genai.configure(api_key=clean_key, transport=GENAI_TRANSPORT)
+        log.info("gemini connected", extra={"serving": "gevent" if GEVENT_ACTIVE else "threaded", "transport": GENAI_TRANSPORT or "default"})
+    except Exception as e:
+        log.error("gemini connection failed", extra={"error": str(e)})
+
+# Shared model clients + per-model latency/health tracking for every candidate list
+model_router = ModelRouter(genai.GenerativeModel, cooldown=int(os.environ.get('MODEL_BREAKER_COOLDOWN', 30)), observer=model_attempt)
+
+# --- CONFIG: EMBEDDING CACHE ---
+EMBED_MODEL = os.environ.get("EMBED_MODEL", "models/text-embedding-004")
+embedding_cache = EmbeddingCache(
+    app.config['SESSION_REDIS'],
+    local_size=int(os.environ.get('EMBED_CACHE_LOCAL_SIZE', 512)),
+    ttl=int(os.environ.get('EMBED_CACHE_TTL', 30 * 86400)),
+    max_keys=int(os.environ.get('EMBED_CACHE_MAX_KEYS', 50000))
+)
+
+# --- CONFIG: PROFILE CACHE ---
+# Read-through cache of the dashboard's user fields; every users_col write path invalidates or refreshes it
+profile_cache = ProfileCache(app.config['SESSION_REDIS'], ttl=int(os.environ.get('PROFILE_CACHE_TTL', 60)))
+
+def load_profile(user_id):
+    return profile_cache.get(user_id, lambda: users_col.find_one({"user_id": user_id}, PROFILE_PROJECTION))
+
+# --- CONFIG: EXECUTION LAYER ---
+# Bounded pool for independent Gemini/Mongo calls inside a request (up to 4 jobs per /api/process).
+# Sync workers serve one request at a time; under gevent the pool's threads are greenlets, so it is sized
+# to the worker's WORKER_CONNECTIONS instead of queueing every in-flight request behind 8 slots.
+AI_POOL_JOBS_PER_REQUEST = 4
+AI_POOL_SIZE = int(os.environ.get('AI_POOL_SIZE') or (AI_POOL_JOBS_PER_REQUEST * int(os.environ.get('WORKER_CONNECTIONS', 200)) if GEVENT_ACTIVE else 8))
+AI_POOL = ThreadPoolExecutor(max_workers=AI_POOL_SIZE, thread_name_prefix='celi-ai')
+GEMINI_TIMEOUT = float(os.environ.get('GEMINI_TIMEOUT', 30))
+EMBED_TIMEOUT = float(os.environ.get('EMBED_TIMEOUT', 8))
+
+def await_result(future, timeout, default=None):
+    """Waits for a pooled call; returns `default` if it fails or exceeds its timeout."""
+    if future is None: return default
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        log.warning("pool call timed out, using default", extra={"timeout": timeout})
     except Exception as e:
-        print(f"❌ Gemini AI Connection Failed: {e}")
+        log.warning("pool call failed, using default", extra={"error": str(e)})
+    return default
 
 # ==================================================
 #           THE ECHO PROTOCOL (MEMORY)
@@ -69,68 +171,60 @@ if api_key:
 def get_embedding(text):
     try:
         if not text or len(text) < 5: return None
-        # Use stable embedding model
+        with timed("embedding"):
+            return embedding_cache.get_or_compute(text, EMBED_MODEL, "retrieval_document", lambda: _embed_remote(text))
+    except Exception as e:
+        log.warning("embedding failed", extra={"error": str(e)})
+        return None
+
+def _embed_remote(text):
+    # Use stable embedding model
+    with timed("gemini_embed"):
         result = genai.embed_content(
-            model="models/text-embedding-004",
+            model=EMBED_MODEL,
             content=text,
             task_type="retrieval_document",
-            title="Journal Entry"
+            title="Journal Entry",
+            request_options={"timeout": EMBED_TIMEOUT}
         )
-        return result['embedding']
-    except Exception as e:
-        print(f"Embedding Error: {e}")
-        return None
+    return result['embedding']
 
-def find_similar_memories(user_id, query_text):
+def find_similar_memories(user_id, query_text, query_vector=None):
     if not query_text or history_col is None: return []
-    query_vector = get_embedding(query_text)
+    if query_vector is None: query_vector = get_embedding(query_text)
     if not query_vector: return []
 
-    pipeline = [
-        {
-            "$vectorSearch": {
-                "index": "vector_index",
-                "path": "embedding",
-                "queryVector": query_vector,
-                "numCandidates": 50,
-                "limit": 3,
-                "filter": {"user_id": user_id}
-            }
-        },
-        {
-            "$project": {
-                "_id": 0,
-                "full_message": 1,
-                "date": 1,
-                "summary": 1,
-                "score": {"$meta": "vectorSearchScore"}
-            }
-        }
-    ]
     try:
-        results = list(history_col.aggregate(pipeline))
-        return [r for r in results if r['score'] > 0.65] 
+        with timed("vector_search"):
+            return vector_search.search(user_id, query_vector, limit=3, min_score=0.65)
     except Exception as e:
-        print(f"Vector Search Error: {e}")
+        log.warning("vector search failed", extra={"error": str(e)})
         return []
 
+def recall_memories(user_id, text):
+    """Embeds `text` once and reuses the vector for the memory search. Returns (embedding, memories)."""
+    embedding = get_embedding(text)
+    return embedding, find_similar_memories(user_id, text, query_vector=embedding)
+
 # ==================================================
 #                 HELPER FUNCTIONS
 # ==================================================
 
-def generate_analysis(entry_text):
-    """Generates psychological analysis for the Archive Modal."""
+def generate_analysis(entry_text, image_bytes=None, image_mime=None):
+    """Generates psychological analysis for the Archive Modal (using the entry's image when given)."""
     # V12.18: Updated to Gemini 2.5 Flash
     candidates = ["gemini-2.5-flash", "gemini-2.0-flash"]
     
-    for m in candidates:
+    for m in model_router.order(candidates):
         try:
-            model = genai.GenerativeModel(m)
+            model = model_router.model(m)
             prompt = f"Provide a warm, human-like psychological insight about this journal entry. Speak directly to 'You'. Keep it to 1 or 2 sentences max. Entry: {entry_text}"
-            response = model.generate_content(prompt)
+            content = [prompt, {'mime_type': image_mime, 'data': image_bytes}] if image_bytes else prompt
+            with model_router.attempt(m):
+                response = model.generate_content(content, request_options={"timeout": GEMINI_TIMEOUT})
             return response.text.strip()
         except Exception as e:
-            print(f"Analysis Error ({m}): {e}")
+            log.warning("analysis attempt failed", extra={"model": m, "error": str(e)})
             continue
             
     return "Analysis unavailable due to signal interference."
@@ -140,11 +234,12 @@ def generate_summary(entry_text):
     # V12.18: Updated to Gemini 2.5 Flash
     candidates = ["gemini-2.5-flash", "gemini-2.0-flash"]
     
-    for m in candidates:
+    for m in model_router.order(candidates):
         try:
-            model = genai.GenerativeModel(m)
+            model = model_router.model(m)
             prompt = f"Write a 1 or 2 sentence recap of this entry addressed to 'You', as if you are a supportive friend remembering it. Do not start with 'You mentioned'. Entry: {entry_text}"
-            response = model.generate_content(prompt)
+            with model_router.attempt(m):
+                response = model.generate_content(prompt, request_options={"timeout": GEMINI_TIMEOUT})
             return response.text.strip().replace('"', '').replace("'", "")
         except:
             continue
@@ -153,18 +248,20 @@ def generate_summary(entry_text):
 
 def generate_constellation_name(entries_text):
     try:
-        model = genai.GenerativeModel("gemini-2.5-flash")
+        model = model_router.model("gemini-2.5-flash")
         prompt = f"Here are 7 days of journal entries. Give them a mystical 'Constellation Name' (e.g., 'The Week of Rain'). Just the name. Entries: {entries_text}"
-        response = model.generate_content(prompt)
+        with model_router.attempt("gemini-2.5-flash"):
+            response = model.generate_content(prompt, request_options={"timeout": GEMINI_TIMEOUT})
         return response.text.strip().replace('"', '').replace("'", "")
     except:
         return "Unknown Constellation"
 
-def generate_with_media(msg, media_bytes=None, media_mime=None, is_void=False, context_memories=[]):
-    """Main generation logic for Celi/Void responses with Fallback."""
-    # V12.18: Updated Candidate List for 2026 Timeline
-    candidates = ["gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-2.0-flash"]
-    
+# V12.18: Updated Candidate List for 2026 Timeline
+GENERATION_CANDIDATES = ["gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-2.0-flash"]
+SIGNAL_LOST = "Signal Lost. Visual/Text processing failed. Please check your API Key or connection."
+
+def build_generation_prompt(msg, media_bytes=None, media_mime=None, is_void=False, context_memories=[]):
+    """Returns (system_instruction, content, has_media) for a Celi/Void reply."""
     memory_block = ""
     if context_memories:
         memory_block = "\n\nRELEVANT PAST MEMORIES (Use these to connect patterns, but don't repeat them explicitly):\n"
@@ -180,30 +277,214 @@ def generate_with_media(msg, media_bytes=None, media_mime=None, is_void=False, c
     if media_bytes and media_mime and 'image' in media_mime:
         has_media = True
         content.append({'mime_type': media_mime, 'data': media_bytes})
+    return system_instruction, content, has_media
+
+def generate_with_media(msg, media_bytes=None, media_mime=None, is_void=False, context_memories=[]):
+    """Main generation logic for Celi/Void responses with Fallback."""
+    system_instruction, content, has_media = build_generation_prompt(msg, media_bytes, media_mime, is_void, context_memories)
 
     # Try generating with media first
-    for m in candidates:
+    for m in model_router.order(GENERATION_CANDIDATES):
         try:
-            model = genai.GenerativeModel(m, system_instruction=system_instruction)
-            response = model.generate_content(content)
-            if not response.text: raise Exception("Empty response")
+            model = model_router.model(m, system_instruction)
+            with model_router.attempt(m):
+                response = model.generate_content(content, request_options={"timeout": GEMINI_TIMEOUT})
+                if not response.text: raise Exception("Empty response")
             return response.text.strip()
         except Exception as e:
-            print(f"DEBUG: Model Error ({m}): {e}")
+            log.warning("model attempt failed", extra={"model": m, "error": str(e)})
             continue
 
     # FALLBACK: If media generation failed, try text-only
     if has_media:
-        print("⚠️ Media processing failed. Retrying with text-only fallback...")
+        log.warning("media generation failed, retrying text-only")
         try:
             # Fallback to lite model for speed/stability
-            model = genai.GenerativeModel("gemini-2.5-flash-lite", system_instruction=system_instruction)
-            response = model.generate_content(msg + " [Image attached but signal weak]")
+            model = model_router.model("gemini-2.5-flash-lite", system_instruction)
+            with model_router.attempt("gemini-2.5-flash-lite"):
+                response = model.generate_content(msg + " [Image attached but signal weak]", request_options={"timeout": GEMINI_TIMEOUT})
             return response.text.strip()
         except Exception as e:
-            print(f"Fallback Error: {e}")
+            log.warning("text-only fallback failed", extra={"error": str(e)})
 
-    return "Signal Lost. Visual/Text processing failed. Please check your API Key or connection."
+    return SIGNAL_LOST
+
+def _stream_chunks(response):
+    for chunk in response:
+        try: text = chunk.text
+        except ValueError: continue  # Chunk without text parts (e.g. safety metadata)
+        if text: yield text
+
+def stream_with_media(msg, media_bytes=None, media_mime=None, is_void=False, context_memories=[]):
+    """Streaming variant of generate_with_media: yields text chunks, same candidate routing and fallback.
+    A model that fails before its first token falls through to the next; once tokens are out, the reply ends there."""
+    system_instruction, content, has_media = build_generation_prompt(msg, media_bytes, media_mime, is_void, context_memories)
+
+    for m in model_router.order(GENERATION_CANDIDATES):
+        started = False
+        try:
+            model = model_router.model(m, system_instruction)
+            with model_router.attempt(m):
+                for text in _stream_chunks(model.generate_content(content, stream=True, request_options={"timeout": GEMINI_TIMEOUT})):
+                    started = True
+                    yield text
+                if not started: raise Exception("Empty response")
+            return
+        except Exception as e:
+            log.warning("model attempt failed", extra={"model": m, "error": str(e)})
+            if started: return
+
+    if has_media:
+        log.warning("media generation failed, retrying text-only")
+        started = False
+        try:
+            model = model_router.model("gemini-2.5-flash-lite", system_instruction)
+            with model_router.attempt("gemini-2.5-flash-lite"):
+                for text in _stream_chunks(model.generate_content(msg + " [Image attached but signal weak]", stream=True, request_options={"timeout": GEMINI_TIMEOUT})):
+                    started = True
+                    yield text
+        except Exception as e:
+            log.warning("text-only fallback failed", extra={"error": str(e)})
+        if started: return
+
+    yield SIGNAL_LOST
+
+# ==================================================
+#           BACKGROUND JOBS (CELERY)
+# ==================================================
+
+@celery_app.task(name="celi.summarize_entry")
+def summarize_entry(user_id, timestamp, msg):
+    """Fills in the Echo recap of a saved entry."""
+    if history_col is None: return
+    summary = generate_summary(msg)
+    with sync_write(users_col, user_id) as seq:
+        history_col.update_one({"user_id": user_id, "timestamp": timestamp}, {"$set": {"summary": summary, "updated_at": time.time(), "sync_seq": seq}})
+
+@celery_app.task(name="celi.embed_entry")
+def embed_entry(user_id, timestamp, msg):
+    """Stores the memory vector of a saved entry for the Echo Protocol."""
+    if history_col is None: return
+    embedding = get_embedding(msg)
+    if embedding: history_col.update_one({"user_id": user_id, "timestamp": timestamp}, {"$set": {"embedding": embedding, "embedding_model": EMBED_MODEL}})
+
+@celery_app.task(name="celi.name_constellation")
+def name_constellation(user_id, group):
+    """Names a completed constellation from its member entries and stamps the name on its stars."""
+    if constellations_col is None: return
+    constellation = constellations_col.find_one({"user_id": user_id, "group": group, "name": None}, {"members": 1})
+    if not constellation: return
+    members = constellation['members']
+    entries = history_col.find({"user_id": user_id, "timestamp": {"$in": members}}, {'full_message': 1})
+    text_block = " ".join([e.get('full_message') or '' for e in entries])
+    name = generate_constellation_name(text_block)
+    # Only the first naming wins; the stars' sync_seq moves so galaxy delta syncs pick the name up
+    if set_name(constellations_col, user_id, group, name) is not None:
+        with sync_write(users_col, user_id) as seq:
+            history_col.update_many({"user_id": user_id, "timestamp": {"$in": members}}, {"$set": {"constellation_name": name, "updated_at": time.time(), "sync_seq": seq}})
+
+# --- ARCHIVE ANALYSIS (single-flight) ---
+# One in-flight generation per (user, entry): the Redis key is taken before queueing and released by the job.
+# The lock outlives the job's hard time limit plus a queueing allowance, so it can't expire under a running job.
+ANALYSIS_TIME_LIMIT = int(os.environ.get('ANALYSIS_TIME_LIMIT', 180))
+ANALYSIS_QUEUE_GRACE = int(os.environ.get('ANALYSIS_QUEUE_GRACE', 120))
+ANALYSIS_LOCK_TTL = ANALYSIS_TIME_LIMIT + 15 + ANALYSIS_QUEUE_GRACE
+# Opt-in: analysing every entry ahead of time spends a generation per entry, opened or not
+PRECOMPUTE_ANALYSIS = os.environ.get('PRECOMPUTE_ANALYSIS', '0') == '1'
+
+def analysis_lock_key(user_id, timestamp):
+    return f"celi:analysis:{user_id}:{timestamp}"
+
+def acquire_flight(key, ttl):
+    """True if this caller now owns `key`. Without Redis every caller proceeds (the write stays conditional)."""
+    try:
+        return bool(app.config['SESSION_REDIS'].set(key, "1", nx=True, ex=ttl))
+    except Exception as e:
+        log.warning("flight lock failed", extra={"key": key, "error": str(e)})
+        return True
+
+def release_flight(key):
+    try: app.config['SESSION_REDIS'].delete(key)
+    except Exception as e: log.warning("flight lock failed", extra={"key": key, "error": str(e)})
+
+def request_analysis(user_id, timestamp):
+    """Queues the archive analysis for an entry unless one is already in flight."""
+    if acquire_flight(analysis_lock_key(user_id, timestamp), ANALYSIS_LOCK_TTL):
+        dispatch(analyze_entry, user_id, timestamp)
+
+@celery_app.task(name="celi.analyze_entry", soft_time_limit=ANALYSIS_TIME_LIMIT, time_limit=ANALYSIS_TIME_LIMIT + 15)
+def analyze_entry(user_id, timestamp):
+    """Generates and stores `ai_analysis` once; the caller holds the flight lock."""
+    try:
+        if history_col is None: return
+        entry = history_col.find_one({"user_id": user_id, "timestamp": timestamp, "ai_analysis": None}, {'full_message': 1, 'media_file_id': 1})
+        if not entry: return  # Already analysed
+        image, image_mime = None, None
+        if entry.get('media_file_id'):
+            try: image, image_mime = model_image(fs, entry['media_file_id'], max_side=MODEL_IMAGE_MAX_SIDE, quality=MODEL_IMAGE_QUALITY)
+            except Exception as e: log.warning("archive image failed", extra={"timestamp": timestamp, "error": str(e)})
+        analysis = generate_analysis(entry.get('full_message', ''), image, image_mime)
+        history_col.update_one({"user_id": user_id, "timestamp": timestamp, "ai_analysis": None}, {"$set": {"ai_analysis": analysis}})
+    finally:
+        release_flight(analysis_lock_key(user_id, timestamp))
+
+@celery_app.task(name="celi.precompute_analyses")
+def precompute_analyses(days=7, limit=500):
+    """Periodic sweep: queues analyses for recent entries nobody has opened yet."""
+    if history_col is None: return
+    since = str((datetime.now() - timedelta(days=days)).timestamp())
+    # Cross-user scan served by the partial `pending_analysis` index (entries are always written with ai_analysis: null)
+    for entry in history_col.find({"timestamp": {"$gte": since}, "ai_analysis": {"$type": "null"}}, {'user_id': 1, 'timestamp': 1}).limit(limit):
+        request_analysis(entry['user_id'], entry['timestamp'])
+
+# --- STORAGE CLEANUP (account deletion, GridFS garbage collection) ---
+ORPHAN_GRACE = timedelta(hours=float(os.environ.get('ORPHAN_GRACE_HOURS', 24)))
+SWEEP_LIMIT = int(os.environ.get('SWEEP_LIMIT', 5000))
+
+@celery_app.task(name="celi.delete_account")
+def delete_account(user_id):
+    """Removes a deleted account's history and no longer referenced uploads in bounded batches."""
+    if db is None: return
+    stats = delete_account_data(db, fs, user_id)
+    log.info("account deleted", extra={"user_id": user_id, **stats})
+
+@celery_app.task(name="celi.collect_files")
+def collect_files_job(file_ids):
+    """Drops uploads that just lost their last reference (e.g. a replaced profile picture)."""
+    if db is None: return
+    collect_files(db, fs, [ObjectId(i) for i in file_ids])
+
+@celery_app.task(name="celi.sweep_storage")
+def sweep_storage():
+    """Periodic: retries unfinished account deletions, then sweeps a slice of GridFS for orphaned files."""
+    if db is None: return
+    for user_id in stale_deletions(db, timedelta(hours=6)): dispatch(delete_account, user_id)
+    stats = sweep_orphans(db, fs, ORPHAN_GRACE, SWEEP_LIMIT)
+    log.info("storage sweep", extra=stats)
+
+celery_app.conf.beat_schedule = {
+    "sweep-storage": {"task": "celi.sweep_storage", "schedule": 60 * 60},
+}
+if PRECOMPUTE_ANALYSIS:
+    celery_app.conf.beat_schedule["precompute-analyses"] = {"task": "celi.precompute_analyses", "schedule": 15 * 60}
+
+BROKER_COOLDOWN = float(os.environ.get('BROKER_COOLDOWN', 30))
+_broker_down_until = 0.0
+
+def dispatch(task, *args):
+    """
+    Queues a job (one attempt, BROKER_PUBLISH_TIMEOUT); runs it inline if the broker is unreachable so no entry is left unfilled.
+    After a failed publish the broker is skipped for BROKER_COOLDOWN seconds instead of paying the timeout on every job.
+    """
+    global _broker_down_until
+    if time.time() >= _broker_down_until:
+        try:
+            task.apply_async(args, retry=False)
+            return
+        except Exception as e:
+            _broker_down_until = time.time() + BROKER_COOLDOWN
+            log.warning("queue unavailable, running inline", extra={"task": task.name, "error": str(e), "cooldown": BROKER_COOLDOWN})
+    task(*args)
 
 # ==================================================
 #                 ROUTES
@@ -234,14 +515,105 @@ def logout(): session.clear(); return redirect(url_for('login_page'))
 def privacy_policy():
     return render_template('privacy_policy.html')
 
+# --- INSTRUMENTATION ---
+@app.before_request
+def start_timings():
+    begin_request()
+
+@app.after_request
+def add_server_timing(response):
+    """Server-Timing per stage (gemini, mongo, gridfs, embedding, vector_search ...) + request histogram.
+    Streamed responses are observed when the stream closes."""
+    timings = current_timings()
+    if timings is None: return response
+    response.headers['Server-Timing'] = timings.server_timing()
+    endpoint, method, status = request.url_rule.rule if request.url_rule else "unmatched", request.method, response.status_code
+
+    def finish():
+        elapsed = timings.elapsed()
+        observe_request(endpoint, method, status, elapsed)
+        if elapsed * 1000 >= SLOW_REQUEST_MS:
+            log.warning("slow request", extra={"endpoint": endpoint, "method": method, "status": status,
+                                               "ms": round(elapsed * 1000, 1), "stages": timings.as_dict()})
+    if response.is_streamed: response.call_on_close(finish)
+    else: finish()
+    return response
+
+# --- OPERATOR ENDPOINTS ---
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+def operator_request():
+    """True when the request carries `Authorization: Bearer <METRICS_TOKEN>`."""
+    return bool(METRICS_TOKEN) and hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}")
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint. With METRICS_TOKEN set, requires `Authorization: Bearer <token>`."""
+    if METRICS_TOKEN and not operator_request(): return Response(status=401)
+    body, content_type = metrics_payload()
+    return Response(body, mimetype=content_type)
+
+# Process internals: operators only, and disabled entirely while METRICS_TOKEN is unset
+@app.route('/api/debug/embedding_cache')
+def embedding_cache_stats():
+    if not operator_request(): return jsonify({"status": "error", "message": "Operator token required"}), 401
+    return jsonify(embedding_cache.stats())
+
+@app.route('/api/debug/profile_cache')
+def profile_cache_stats():
+    if not operator_request(): return jsonify({"status": "error", "message": "Operator token required"}), 401
+    return jsonify(profile_cache.stats())
+
+@app.route('/api/debug/models')
+def model_router_stats():
+    if not operator_request(): return jsonify({"status": "error", "message": "Operator token required"}), 401
+    return jsonify(model_router.stats())
+
+# GridFS file ids never change, so media is cacheable forever
+MEDIA_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+def iter_grid_out(grid_out, start, length):
+    """Yields `length` bytes of a GridFS file from `start`, one stored chunk at a time."""
+    grid_out.seek(start)
+    remaining = length
+    while remaining > 0:
+        data = grid_out.read(min(grid_out.chunk_size, remaining))
+        if not data: break
+        remaining -= len(data)
+        yield data
+
 @app.route('/api/media/<file_id>')
 def get_media(file_id):
+    if fs is None: return "Database Error", 500
     try:
-        if fs is None: return "Database Error", 500
         grid_out = fs.get(ObjectId(file_id))
-        return Response(grid_out.read(), mimetype=grid_out.content_type)
     except: return "File not found", 404
 
+    etag = grid_out.md5 or file_id
+    headers = {"ETag": f'"{etag}"', "Cache-Control": MEDIA_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    last_modified = grid_out.upload_date
+    if last_modified: headers["Last-Modified"] = last_modified.strftime("%a, %d %b %Y %H:%M:%S GMT")
+
+    # Conditional GET
+    if request.if_none_match.contains(etag) or ('If-None-Match' not in request.headers and request.if_modified_since and last_modified
+                                                and request.if_modified_since.replace(tzinfo=None) >= last_modified.replace(microsecond=0, tzinfo=None)):
+        return Response(status=304, headers=headers)
+
+    # Single range request (ignored when If-Range names another version); multi-range gets the full body
+    total = grid_out.length
+    start, end, status = 0, total, 200
+    if request.range and len(request.range.ranges) == 1 and ('If-Range' not in request.headers or request.if_range.etag == etag):
+        span = request.range.range_for_length(total)
+        if span is None:
+            headers["Content-Range"] = f"bytes */{total}"
+            return Response(status=416, headers=headers)
+        start, end = span
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{total}"
+
+    headers["Content-Length"] = str(end - start)
+    return Response(iter_grid_out(grid_out, start, end - start), status=status, mimetype=grid_out.content_type, headers=headers, direct_passthrough=True)
+
 # --- PROFILE UPDATES ---
 @app.route('/api/update_pfp', methods=['POST'])
 def update_pfp():
@@ -249,11 +621,16 @@ def update_pfp():
     try:
         file = request.files['pfp']
         if file:
-            file_id = fs.put(file.read(), filename=f"pfp_{session['user_id']}", content_type=file.mimetype)
+            file_id, _ = store_upload(fs, file, f"pfp_{session['user_id']}", MAX_PFP_BYTES)
+            if not file_id: return jsonify({"status": "error", "message": "No file"})
             pfp_url = f"/api/media/{file_id}"
-            users_col.update_one({"user_id": session['user_id']}, {"$set": {"profile_pic": pfp_url}})
+            before = users_col.find_one_and_update({"user_id": session['user_id']}, {"$set": {"profile_pic": pfp_url}}, {"profile_pic": 1})
+            profile_cache.invalidate(session['user_id'])
+            old_id = pfp_file_id((before or {}).get('profile_pic'))
+            if old_id and old_id != file_id: dispatch(collect_files_job, [str(old_id)])
             return jsonify({"status": "success", "url": pfp_url})
         return jsonify({"status": "error", "message": "No file"})
+    except UploadTooLarge as e: return jsonify({"status": "error", "message": str(e)}), 413
     except Exception as e: return jsonify({"status": "error", "message": str(e)})
 
 @app.route('/api/update_profile', methods=['POST'])
@@ -268,6 +645,7 @@ def update_profile():
         
         if updates:
             users_col.update_one({"user_id": session['user_id']}, {"$set": updates})
+            profile_cache.invalidate(session['user_id'])
             return jsonify({"status": "success"})
         return jsonify({"status": "error", "message": "No changes detected"})
     except Exception as e: return jsonify({"status": "error", "message": str(e)})
@@ -286,6 +664,7 @@ def update_security():
         
         if updates:
             users_col.update_one({"user_id": session['user_id']}, {"$set": updates})
+            profile_cache.invalidate(session['user_id'])
             return jsonify({"status": "success"})
         return jsonify({"status": "error", "message": "No data"})
     except Exception as e: return jsonify({"status": "error", "message": str(e)})
@@ -310,11 +689,10 @@ def register():
 def get_data():
     if 'user_id' not in session: return jsonify({"status": "guest"}), 401
     if users_col is None: return jsonify({"status": "error"}), 500
-    user = users_col.find_one({"user_id": session['user_id']})
+    user = load_profile(session['user_id'])
     if not user: return jsonify({"status": "error"}), 404
     
     rank_info = get_rank_meta(user.get('rank_index', 0))
-    progression_tree = get_all_ranks_data()
     max_dust = rank_info['req']
     current_dust = user.get('stardust', 0)
     
@@ -340,23 +718,106 @@ def get_data():
         "stardust_max": max_dust,
         "history": loaded_history, 
         "profile_pic": user.get("profile_pic", ""),
-        "progression_tree": progression_tree
+        "rank_catalog_url": f"/api/rank_catalog/{RANK_CATALOG_VERSION}"
     })
 
+@app.route('/api/rank_catalog')
+@app.route('/api/rank_catalog/<version>')
+def rank_catalog(version=None):
+    """Static rank tree (titles, reqs, SVGs). Versioned URLs are immutable; the bare URL revalidates."""
+    headers = {"ETag": f'"{RANK_CATALOG_VERSION}"'}
+    headers["Cache-Control"] = "public, max-age=31536000, immutable" if version == RANK_CATALOG_VERSION else "public, no-cache"
+    if request.if_none_match.contains(RANK_CATALOG_VERSION): return Response(status=304, headers=headers)
+    return Response(RANK_CATALOG_JSON, mimetype='application/json', headers=headers)
+
+# --- GALAXY MAP ---
+# Each star stores its ordinal (`star_index`) and constellation (`constellation_group`) once, at insert time.
+# Every galaxy-visible write stamps `sync_seq` from the user's server-side counter; it is the incremental sync cursor.
+# The cursor handed out is the committed high-water mark (constellations.committed_sync_seq), so a seq reserved by a
+# write that has not landed yet is never skipped: the delta is (since, committed] and empty when nothing changed.
+# Constellation names come from the materialized `constellations` collection.
+GALAXY_FIELDS = ["id", "date", "summary", "type", "has_media", "has_audio", "group", "constellation_name", "index"]
+GALAXY_PROJECTION = {'_id': 1, 'timestamp': 1, 'date': 1, 'summary': 1, 'mode': 1, 'has_media': 1, 'has_audio': 1,
+                     'constellation_name': 1, 'star_index': 1, 'constellation_group': 1}
+
+def next_star_index(user_id):
+    """Allocates the next star ordinal from the user's counter."""
+    return allocate_star_indexes(users_col, history_col, user_id)
+
+def backfill_star_indexes(docs):
+    """Stores ordinals for stars saved before they were assigned at insert (docs must be the full history, in order)."""
+    ops = []
+    for index, doc in enumerate(docs):
+        if doc.get('star_index') is None:
+            doc['star_index'], doc['constellation_group'] = index, group_for(index)
+            ops.append(UpdateOne({"_id": doc['_id']}, {"$set": {"star_index": index, "constellation_group": doc['constellation_group']}}))
+    if ops: history_col.bulk_write(ops, ordered=False)
+
+def star_row(doc, names):
+    group = doc.get('constellation_group')
+    return [doc['timestamp'], doc['date'], doc.get('summary', '...'), "void" if doc.get('mode') == 'rant' else "journal",
+            doc.get('has_media', False), doc.get('has_audio', False), group,
+            names.get(group, doc.get('constellation_name')), doc.get('star_index')]
+
 @app.route('/api/galaxy_map')
 def galaxy_map():
+    """Full star list by default. `?since=<cursor>` returns only stars written after the cursor;
+    `?format=compact` returns {fields, rows, cursor} with one array per star."""
+    if 'user_id' not in session: return jsonify([])
+    user_id = session['user_id']
+    since = request.args.get('since', type=int)
+    compact = request.args.get('format') == 'compact'
+
+    # Read before the stars: anything that lands in between is sent again next time, never skipped
+    cursor = committed_sync_seq(users_col, user_id)
+    if since is None:
+        docs = list(history_col.find({"user_id": user_id}, GALAXY_PROJECTION).sort("timestamp", 1))
+        backfill_star_indexes(docs)
+        # Accounts that predate the constellations collection are materialized on their first full load
+        # (imports can append older entries, so the last group is the highest star_index, not the latest timestamp)
+        if docs and constellations_col.count_documents({"user_id": user_id}) < group_for(max(d['star_index'] for d in docs)) + 1:
+            rebuild_constellations(constellations_col, user_id, docs)
+        names = constellation_names(constellations_col, user_id)
+    elif since >= cursor:
+        docs, names, cursor = [], {}, since
+    else:
+        docs = list(history_col.find({"user_id": user_id, "sync_seq": {"$gt": since, "$lte": cursor}}, GALAXY_PROJECTION).sort("timestamp", 1))
+        names = constellation_names(constellations_col, user_id, {d.get('constellation_group') for d in docs}) if docs else {}
+
+    rows = [star_row(d, names) for d in docs]
+    if compact or since is not None:
+        return jsonify({"fields": GALAXY_FIELDS, "rows": rows, "cursor": cursor})
+    return jsonify([dict(zip(GALAXY_FIELDS, row)) for row in rows])
+
+@app.route('/api/constellations')
+def list_constellations():
+    """The user's constellations (group, name, date range, size) straight from the materialized collection."""
     if 'user_id' not in session: return jsonify([])
-    cursor = history_col.find({"user_id": session['user_id']}, 
-                              {'_id': 0, 'full_message': 0, 'reply': 0, 'embedding': 0, 'media_file_id': 0, 'audio_file_id': 0}).sort("timestamp", 1)
-    stars = []
-    for index, doc in enumerate(cursor):
-        stars.append({
-            "id": doc['timestamp'], "date": doc['date'], "summary": doc.get('summary', '...'),
-            "type": "void" if doc.get('mode') == 'rant' else "journal",
-            "has_media": doc.get('has_media', False), "has_audio": doc.get('has_audio', False),
-            "group": index // 7, "constellation_name": doc.get('constellation_name', None), "index": index
-        })
-    return jsonify(stars)
+    docs = constellations_col.find({"user_id": session['user_id']}, {"_id": 0, "user_id": 0}).sort("group", 1)
+    return jsonify([{"group": c['group'], "name": c.get('name'), "first_date": c.get('first_date'), "last_date": c.get('last_date'),
+                     "size": len(c.get('members', []))} for c in docs])
+
+@app.route('/api/search')
+def search():
+    """`?q=` keywords, `from`/`to` (YYYY-MM-DD), `mode` (journal|rant), `limit`, `cursor`;
+    `semantic=1` fuses the keyword ranking with the Echo vector search."""
+    if 'user_id' not in session: return jsonify({"error": "Auth"}), 401
+    user_id, args = session['user_id'], request.args
+    text = args.get('q', '')[:200]
+    vector_hits = None
+    if args.get('semantic') == '1' and text:
+        query_vector = get_embedding(text)
+        if query_vector:
+            try:
+                with timed("vector_search"):
+                    vector_hits = [(m['timestamp'], m['score']) for m in vector_search.search(user_id, query_vector, limit=50, min_score=0.55) if m.get('timestamp')]
+            except Exception as e:
+                log.warning("vector search failed", extra={"error": str(e)})
+    try:
+        return jsonify(search_history(history_col, user_id, text, args.get('from'), args.get('to'), args.get('mode'),
+                                      args.get('limit', 20, type=int), args.get('cursor'), vector_hits))
+    except ValueError as e:
+        return jsonify({"error": f"Bad query: {e}"}), 400
 
 @app.route('/api/star_detail', methods=['POST'])
 def star_detail():
@@ -366,11 +827,9 @@ def star_detail():
     entry = history_col.find_one({"user_id": session['user_id'], "timestamp": timestamp}, {'_id': 0, 'embedding': 0})
     if not entry: return jsonify({"error": "Not found"})
     
-    # Lazy Load Analysis
+    # Analysis is generated off the request path; the client polls while it is pending
     analysis = entry.get('ai_analysis')
-    if not analysis:
-        analysis = generate_analysis(entry.get('full_message', ''))
-        history_col.update_one({"user_id": session['user_id'], "timestamp": timestamp}, {"$set": {"ai_analysis": analysis}})
+    if not analysis: request_analysis(session['user_id'], timestamp)
     
     image_url = f"/api/media/{entry['media_file_id']}" if entry.get('media_file_id') else None
     audio_url = f"/api/media/{entry['audio_file_id']}" if entry.get('audio_file_id') else None
@@ -378,98 +837,231 @@ def star_detail():
     return jsonify({
         "date": entry['date'], 
         "analysis": analysis, 
+        "analysis_status": "ready" if analysis else "pending",
         "summary": entry.get('summary', ''),
         "image_url": image_url, 
         "audio_url": audio_url, 
         "mode": entry.get('mode', 'journal')
     })
 
+# --- ENTRY PIPELINE (shared by /api/process and /api/process_stream) ---
+
+def prepare_entry(user_id):
+    """Stores uploads, recalls memories and applies the daily reward for the incoming entry."""
+    msg = request.form.get('message', '')
+    mode = request.form.get('mode', 'journal')
+    image_file = request.files.get('media')
+    audio_file = request.files.get('audio')
+    timestamp = str(datetime.now().timestamp())
+    
+    # GridFS Storage: one streamed, hashed write per upload; the image buffer is reused for the model call
+    media_id, image_bytes = store_upload(fs, image_file, f"img_{timestamp}", MAX_IMAGE_BYTES, keep_bytes=True) if image_file else (None, None)
+    audio_id, _ = store_upload(fs, audio_file, f"aud_{timestamp}", MAX_AUDIO_BYTES) if audio_file else (None, None)
+    image_mime = image_file.mimetype if image_file else None
+
+    # Fan-out: memory recall (one embedding, shared with the vector search) and image preprocessing run alongside the atomic reward/rank update
+    memory_job = AI_POOL.submit(propagate(recall_memories), user_id, msg) if msg and len(msg) > 10 else None
+    image_job = AI_POOL.submit(propagate(model_image), fs, media_id, image_bytes, image_mime, MODEL_IMAGE_MAX_SIDE, MODEL_IMAGE_QUALITY) if media_id else None
+    reward_job = AI_POOL.submit(propagate(apply_entry_rewards), users_col, user_id, msg)
+    index_job = AI_POOL.submit(propagate(next_star_index), user_id)
+    embedding, past_memories = await_result(memory_job, EMBED_TIMEOUT * 2, (None, []))
+    image_bytes, image_mime = await_result(image_job, EMBED_TIMEOUT, (image_bytes, image_mime))
+
+    ctx = {
+        "user_id": user_id, "msg": msg, "mode": mode, "timestamp": timestamp,
+        "media_id": media_id, "audio_id": audio_id, "image_bytes": image_bytes, "image_mime": image_mime,
+        "embedding": embedding, "past_memories": past_memories, "reward_result": reward_job.result(),
+        "star_index": index_job.result()
+    }
+    if ctx['reward_result'].get('user'): profile_cache.put(user_id, ctx['reward_result']['user'])
+    return ctx
+
+def plan_reply(ctx):
+    """Resolves the Void-confirm state. Returns the generate_with_media arguments, or a fixed reply."""
+    msg = ctx['msg']
+    plan = {"reply": None, "command": None, "watch_void": False,
+            "args": (msg, ctx['image_bytes'], ctx['image_mime']), "is_void": False, "context_memories": ctx['past_memories']}
+    if ctx['mode'] == 'rant':
+        plan['is_void'] = True
+    elif session.get('awaiting_void_confirm', False) or (SESSION_BACKEND == 'cookie' and request.form.get('void_pending') == '1'):
+        session['awaiting_void_confirm'] = False
+        if any(x in msg.lower() for x in ["yes", "sure", "ok"]):
+            plan['reply'], plan['command'] = "Understood. Opening Void...", "switch_to_void"
+        else:
+            plan['args'] = (f"User declined void. Respond: {msg}", ctx['image_bytes'], ctx['image_mime'])
+            plan['context_memories'] = []
+    else:
+        plan['watch_void'] = True
+    return plan
+
+def finalize_entry(ctx, plan, reply):
+    """Saves the entry, queues its background jobs and runs the rank check. Returns the client-facing outcome."""
+    user_id, msg, timestamp = ctx['user_id'], ctx['msg'], ctx['timestamp']
+    reward_result = ctx['reward_result']
+    void_pending = plan['watch_void'] and "open The Void" in reply
+    if void_pending: session['awaiting_void_confirm'] = True
+
+    # Summary, constellation name (and a missed embedding) are filled in by background jobs
+
+    new_entry = {
+        "user_id": user_id,
+        "timestamp": timestamp,
+        "date": datetime.now().strftime("%Y-%m-%d"),
+        "summary": (msg[:50] + "...") if msg else "Visual Entry",
+        "full_message": msg,
+        "reply": reply,
+        "ai_analysis": None,
+        "mode": ctx['mode'],
+        "has_media": bool(ctx['media_id']), "media_file_id": ctx['media_id'],
+        "has_audio": bool(ctx['audio_id']), "audio_file_id": ctx['audio_id'],
+        "constellation_name": None,
+        "is_valid_star": reward_result['awarded'],
+        "embedding": ctx['embedding'], "embedding_model": EMBED_MODEL if ctx['embedding'] else None,
+        "star_index": ctx['star_index'], "constellation_group": group_for(ctx['star_index']),
+        "updated_at": time.time()
+    }
+    with sync_write(users_col, user_id) as seq:
+        new_entry['sync_seq'] = seq
+        history_col.insert_one(new_entry)
+    vector_search.add(user_id, new_entry)
+    constellation_due = add_star(constellations_col, user_id, ctx['star_index'], timestamp, new_entry['date'])
+
+    if msg: dispatch(summarize_entry, user_id, timestamp, msg)
+    if msg and not ctx['embedding']: dispatch(embed_entry, user_id, timestamp, msg)
+    if constellation_due: dispatch(name_constellation, user_id, new_entry['constellation_group'])
+    if PRECOMPUTE_ANALYSIS: request_analysis(user_id, timestamp)
+    
+    command, reward_text, constellation_text = plan['command'], "", ""
+    if reward_result.get('level_up'):
+        command = "level_up"; ranks = f" (+{reward_result['ranks_gained']} Ranks)" if reward_result['ranks_gained'] > 1 else ""
+        reward_text = f"\n\n[System]: Level Up!{ranks} {reward_result.get('message', '')}"
+    elif reward_result['awarded']: command = "daily_reward"; reward_text = f"\n\n[System]: {reward_result['message']}"
+    if constellation_due: constellation_text = "\n[Cosmos]: A new constellation has formed. Its name will appear in your galaxy shortly."
+
+    return {"reply": reply + reward_text + constellation_text, "command": command, "reward": reward_text.strip(),
+            "constellation": constellation_text.strip(), "void_pending": void_pending}
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def persist_session():
+    """Saves session changes made after the response headers went out (streamed responses).
+    A cookie session can't change after the headers; there the client echoes `void_pending` instead."""
+    if SESSION_BACKEND == 'redis' and session.modified: app.session_interface.save_session(app, session, Response())
+
 @app.route('/api/process', methods=['POST'])
 def process():
     if 'user_id' not in session: return jsonify({"reply": "Session Expired"}), 401
     try:
-        msg = request.form.get('message', '')
-        mode = request.form.get('mode', 'journal')
-        image_file = request.files.get('media')
-        audio_file = request.files.get('audio')
-        timestamp = str(datetime.now().timestamp())
-        
-        # GridFS Storage
-        media_id = fs.put(image_file.read(), filename=f"img_{timestamp}", content_type=image_file.mimetype) if image_file else None
-        audio_id = fs.put(audio_file, filename=f"aud_{timestamp}", content_type=audio_file.mimetype) if audio_file else None
-        image_bytes = fs.get(media_id).read() if media_id else None
-        image_mime = image_file.mimetype if image_file else None
-
-        # Vector Context
-        past_memories = []
-        embedding = None
-        if msg and len(msg) > 10:
-            past_memories = find_similar_memories(session['user_id'], msg)
-            embedding = get_embedding(msg)
-
-        reply = "..."
-        reward_result = process_daily_rewards(users_col, session['user_id'], msg)
-        
-        # AI Generation
-        if mode == 'rant':
-            reply = generate_with_media(msg, image_bytes, image_mime, is_void=True, context_memories=past_memories)
-        else:
-            if session.get('awaiting_void_confirm', False):
-                if any(x in msg.lower() for x in ["yes", "sure", "ok"]): 
-                    reply, command, session['awaiting_void_confirm'] = "Understood. Opening Void...", "switch_to_void", False
-                else: 
-                    session['awaiting_void_confirm'] = False
-                    reply = generate_with_media(f"User declined void. Respond: {msg}", image_bytes, image_mime, False)
-            else:
-                reply = generate_with_media(msg, image_bytes, image_mime, False, context_memories=past_memories)
-                if "open The Void" in reply: session['awaiting_void_confirm'] = True
-
-        # Generate Natural Summary for Echo
-        summary_text = generate_summary(msg) if msg else "Visual Entry"
-
-        constellation_name = None
-        if reward_result.get('event') == 'constellation_complete':
-            last_entries = history_col.find({"user_id": session['user_id']}, {'full_message': 1}).sort("timestamp", -1).limit(6)
-            text_block = msg + " " + " ".join([e.get('full_message','') for e in last_entries])
-            constellation_name = generate_constellation_name(text_block)
-
-        history_col.insert_one({
-            "user_id": session['user_id'],
-            "timestamp": timestamp,
-            "date": datetime.now().strftime("%Y-%m-%d"),
-            "summary": summary_text,
-            "full_message": msg,
-            "reply": reply,
-            "ai_analysis": None,
-            "mode": mode,
-            "has_media": bool(media_id), "media_file_id": media_id,
-            "has_audio": bool(audio_id), "audio_file_id": audio_id,
-            "constellation_name": constellation_name,
-            "is_valid_star": reward_result['awarded'],
-            "embedding": embedding
-        })
-        
-        command = None
-        level_check = update_rank_check(users_col, session['user_id'])
-        if level_check == "level_up": command = "level_up"; reply += f"\n\n[System]: Level Up! {reward_result.get('message', '')}"
-        elif reward_result['awarded']: command = "daily_reward"; reply += f"\n\n[System]: {reward_result['message']}"
-        if constellation_name: reply += f"\n[Cosmos]: A new constellation has formed: '{constellation_name}'"
+        ctx = prepare_entry(session['user_id'])
+        plan = plan_reply(ctx)
+        reply = plan['reply'] or generate_with_media(*plan['args'], is_void=plan['is_void'], context_memories=plan['context_memories'])
+        outcome = finalize_entry(ctx, plan, reply)
+        return jsonify({"reply": outcome['reply'], "command": outcome['command'], "void_pending": outcome['void_pending']})
 
-        return jsonify({"reply": reply, "command": command})
+    except UploadTooLarge as e:
+        return jsonify({"reply": f"Signal Overload. {e}."}), 413
+    except Exception as e:
+        log.exception("process failed")
+        return jsonify({"reply": f"Signal Lost. Visual/Text processing failed."}), 500
 
+@app.route('/api/process_stream', methods=['POST'])
+def process_stream():
+    """Same pipeline as /api/process, but streams the reply as Server-Sent Events:
+    `token` events carry text chunks, a final `done` event carries reply, command, reward and constellation."""
+    if 'user_id' not in session: return jsonify({"reply": "Session Expired"}), 401
+    try:
+        ctx = prepare_entry(session['user_id'])
+        plan = plan_reply(ctx)
+    except UploadTooLarge as e:
+        return jsonify({"reply": f"Signal Overload. {e}."}), 413
     except Exception as e:
-        traceback.print_exc()
+        log.exception("process_stream setup failed")
         return jsonify({"reply": f"Signal Lost. Visual/Text processing failed."}), 500
 
+    # prepare_entry already spent the reward and the star ordinal, so the entry must be saved even if the client
+    # goes away: before the generator starts, mid-reply, or at any yield. The close hook covers all of those.
+    state = {"reply": plan['reply'], "parts": [], "finalizing": False}
+    stream = stream_with_media(*plan['args'], is_void=plan['is_void'], context_memories=plan['context_memories']) if state['reply'] is None else None
+
+    def finalize():
+        state['finalizing'] = True
+        outcome = finalize_entry(ctx, plan, state['reply'])
+        persist_session()
+        return outcome
+
+    @copy_current_request_context
+    def save_if_abandoned():
+        if state['finalizing']: return
+        try:
+            if state['reply'] is None:
+                state['parts'].extend(stream)  # Drains the rest of the reply (or all of it, if streaming never started)
+                state['reply'] = "".join(state['parts']).strip() or SIGNAL_LOST
+            finalize()
+        except Exception:
+            log.exception("saving entry after client disconnect failed")
+
+    def events():
+        try:
+            if stream is not None:
+                for text in stream:
+                    state['parts'].append(text)
+                    yield sse("token", {"text": text})
+                state['reply'] = "".join(state['parts']).strip()
+            else:
+                yield sse("token", {"text": state['reply']})
+            yield sse("done", finalize())
+        except Exception as e:
+            log.exception("process_stream failed")
+            yield sse("error", {"reply": "Signal Lost. Visual/Text processing failed."})
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(save_if_abandoned)
+    return response
+
+# --- LOCAL VAULT (EXPORT / IMPORT) ---
+@app.route('/api/export')
+def export_vault():
+    """Streams the user's journal: `?format=zip` (default) or `ndjson`. Embeddings are left out."""
+    if 'user_id' not in session: return jsonify({"error": "Auth"}), 401
+    user = users_col.find_one({"user_id": session['user_id']}, {"_id": 0, "password_hash": 0, "secret_answer_hash": 0})
+    if not user: return jsonify({"error": "Not found"}), 404
+    fmt = request.args.get('format', 'zip')
+    filename = f"celi_vault_{user.get('username', 'user')}_{datetime.now().strftime('%Y%m%d')}"
+    if fmt == 'ndjson':
+        body, mimetype, filename = export_ndjson(fs, history_col, user), 'application/x-ndjson', filename + '.ndjson'
+    else:
+        body, mimetype, filename = export_zip(fs, history_col, user), 'application/zip', filename + '.zip'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"', 'Cache-Control': 'no-store'})
+
+@app.route('/api/import', methods=['POST'])
+def import_journal():
+    """Restores a vault (zip or NDJSON, multipart field `vault`) into the current account."""
+    if 'user_id' not in session: return jsonify({"error": "Auth"}), 401
+    request.max_content_length = MAX_IMPORT_BYTES
+    upload = request.files.get('vault')
+    if not upload: return jsonify({"error": "No vault file"}), 400
+    try:
+        user_id = session['user_id']
+        report = import_vault(db, fs, user_id, upload, max(MAX_IMAGE_BYTES, MAX_AUDIO_BYTES),
+                              on_constellation_complete=lambda group: dispatch(name_constellation, user_id, group))
+    except (ValueError, KeyError) as e:
+        return jsonify({"error": f"Invalid vault: {e}"}), 400
+    return jsonify({"status": "success", **report})
+
 @app.route('/api/clear_history', methods=['POST'])
 def clear_history():
     if 'user_id' not in session: 
         return jsonify({"status": "error", "message": "No active session"}), 401
     try:
         user_id = session['user_id']
-        history_col.delete_many({"user_id": user_id})
-        users_col.delete_one({"user_id": user_id})
+        user = users_col.find_one({"user_id": user_id}, {"user_id": 1, "profile_pic": 1})
+        if user: request_deletion(db, user)
+        profile_cache.invalidate(user_id)
         session.clear()
+        # History, constellations and uploads go in a background job; sweep_storage retries it if it never finishes
+        dispatch(delete_account, user_id)
         return jsonify({"status": "success"})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
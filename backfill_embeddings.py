@@ -0,0 +1,122 @@
+import os
+import sys
+import time
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import UpdateOne
+
+# ==================================================
+#           EMBEDDING BACKFILL (RESUMABLE BATCH JOB)
+# ==================================================
+
+EMBED_MODEL = os.environ.get("EMBED_MODEL", "models/text-embedding-004")
+CHECKPOINT_ID = "embedding_backfill"
+MIN_CHARS = 5  # Same floor as get_embedding
+
+class RateLimiter:
+    """Spaces request starts evenly across threads to stay under `per_minute`."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval: return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now: time.sleep(start - now)
+
+def missing_filter(model, reembed):
+    """Entries without a vector; with `reembed`, also entries embedded by another model."""
+    base = {"full_message": {"$exists": True, "$ne": ""}}
+    if reembed: return {**base, "embedding_model": {"$ne": model}}
+    return {**base, "$or": [{"embedding": None}, {"embedding": {"$size": 0}}]}
+
+def embed_batch(genai, texts, limiter, retries=3):
+    """One batched embedding call with exponential backoff. Returns a list of vectors (or None)."""
+    for attempt in range(retries):
+        limiter.wait()
+        try:
+            result = genai.embed_content(model=EMBED_MODEL, content=texts, task_type="retrieval_document", title="Journal Entry")
+            return result['embedding']
+        except Exception as e:
+            print(f"Embedding Batch Error (attempt {attempt + 1}): {e}")
+            time.sleep(2 ** attempt)
+    return None
+
+def run_backfill(db, genai, batch_size=50, concurrency=4, per_minute=120, reembed=False, restart=False, limit=None):
+    """
+    Streams history in _id order, embeds `concurrency` batches at a time, writes each window with one
+    unordered bulk_write, then checkpoints the window's last _id in `job_checkpoints` so a crash resumes there.
+    """
+    history_col, checkpoints = db['history'], db['job_checkpoints']
+    checkpoint = None if restart else checkpoints.find_one({"_id": CHECKPOINT_ID})
+    query = missing_filter(EMBED_MODEL, reembed)
+    if checkpoint and checkpoint.get("reembed") == reembed and checkpoint.get("last_id"):
+        query["_id"] = {"$gt": checkpoint["last_id"]}
+        print(f"↻ Resuming after {checkpoint['last_id']} ({checkpoint.get('embedded', 0)} embedded so far)")
+    stats = {"embedded": checkpoint.get("embedded", 0) if checkpoint and "_id" in query else 0, "failed": 0, "scanned": 0}
+
+    limiter = RateLimiter(per_minute)
+    cursor = history_col.find(query, {"_id": 1, "full_message": 1}).sort("_id", 1).batch_size(batch_size * concurrency)
+    if limit: cursor = cursor.limit(limit)
+
+    def process_window(window):
+        texts = [[d['full_message'][:8000] for d in batch] for batch in window]
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda t: embed_batch(genai, t, limiter), texts))
+        ops = []
+        for batch, vectors in zip(window, results):
+            if not vectors or len(vectors) != len(batch):
+                stats["failed"] += len(batch)
+                continue
+            for doc, vector in zip(batch, vectors):
+                ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"embedding": vector, "embedding_model": EMBED_MODEL}}))
+        if ops: history_col.bulk_write(ops, ordered=False)
+        stats["embedded"] += len(ops)
+        checkpoints.update_one({"_id": CHECKPOINT_ID}, {"$set": {
+            "last_id": window[-1][-1]["_id"], "reembed": reembed, "embedded": stats["embedded"], "updated_at": datetime.now()
+        }}, upsert=True)
+        print(f"… {stats['embedded']} embedded, {stats['failed']} failed, {stats['scanned']} scanned")
+
+    window, batch = [], []
+    for doc in cursor:
+        if len(doc.get('full_message') or '') < MIN_CHARS: continue
+        stats["scanned"] += 1
+        batch.append(doc)
+        if len(batch) == batch_size:
+            window.append(batch); batch = []
+            if len(window) == concurrency:
+                process_window(window); window = []
+    if batch: window.append(batch)
+    if window: process_window(window)
+
+    checkpoints.update_one({"_id": CHECKPOINT_ID}, {"$set": {"completed_at": datetime.now()}}, upsert=True)
+    return stats
+
+if __name__ == '__main__':
+    import certifi
+    import google.generativeai as genai
+    from pymongo import MongoClient
+    parser = argparse.ArgumentParser(description="Embed history entries that have no vector (or, with --reembed, another model's vector).")
+    parser.add_argument("--batch-size", type=int, default=50, help="texts per embedding request")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight")
+    parser.add_argument("--rpm", type=int, default=120, help="max embedding requests per minute")
+    parser.add_argument("--reembed", action="store_true", help=f"re-embed everything not produced by {EMBED_MODEL}")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint (picks up entries that failed earlier)")
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    mongo_uri, api_key = os.environ.get("MONGO_URI"), os.environ.get("GEMINI_API_KEY")
+    if not mongo_uri or not api_key: sys.exit("MONGO_URI and GEMINI_API_KEY must be set")
+    genai.configure(api_key=api_key.strip().replace("'", "").replace('"', ""))
+    db = MongoClient(mongo_uri, tlsCAFile=certifi.where())['celi_journal_db']
+
+    started = time.time()
+    stats = run_backfill(db, genai, args.batch_size, args.concurrency, args.rpm, args.reembed, args.restart, args.limit)
+    print(f"✅ Done in {time.time() - started:.1f}s: {stats['embedded']} embedded, {stats['failed']} failed")
@@ -0,0 +1,346 @@
+import os
+import sys
+import json
+import time
+import types
+import random
+import hashlib
+import argparse
+import threading
+import contextlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+# ==================================================
+#           OFFLINE BENCHMARK (LOCAL STAND-INS)
+# ==================================================
+# Drives /api/process, /api/data, /api/galaxy_map and /api/star_detail in-process through the Flask test client.
+#   Gemini  -> StubGenAI (configurable latency, jitter and failure injection)
+#   MongoDB -> mongomock + its GridFS integration, or a local mongod with --mongo-uri
+#   Redis   -> fakeredis, or a local redis-server with --redis-url
+#   Celery  -> jobs are counted, not run (the web path only); --run-tasks runs them inline
+# Stand-ins: pip install mongomock fakeredis
+#
+#   python benchmark.py --users 20 --history 300 --requests 2000 --concurrency 8 --json bench.json
+#   python benchmark.py ... --baseline bench.json --tolerance 0.25   # exit 1 if any p95 regresses >25%
+
+ENDPOINTS = ("process", "data", "galaxy_map", "star_detail")
+EMBED_DIM = 768
+WORDS = ("morning walk coffee rain deadline friend call tired grateful music code meeting quiet city dinner "
+         "train book anxious calm proud family gym late project sunset idea letter garden market dream").split()
+
+# --- STUB GEMINI ---
+
+class StubResponse:
+    def __init__(self, text): self.text = text
+
+class StubModel:
+    def __init__(self, stub, name, system_instruction=None):
+        self.stub, self.name, self.system_instruction = stub, name, system_instruction
+
+    def generate_content(self, content, stream=False, request_options=None, **kwargs):
+        with self.stub._lock: self.stub.calls["generate"] += 1
+        text = self.stub.reply_text()
+        if not stream:
+            self.stub.wait(self.stub.latency_ms)
+            return StubResponse(text)
+        return self._stream(text)
+
+    def _stream(self, text):
+        # Time to first token, then the rest of the generation spread across chunks
+        words = text.split()
+        step = max(1, len(words) // self.stub.stream_chunks)
+        self.stub.wait(self.stub.latency_ms * 0.3)
+        for i in range(0, len(words), step):
+            if i: time.sleep(self.stub.latency_ms * 0.7 / self.stub.stream_chunks / 1000)
+            yield StubResponse(" ".join(words[i:i + step]) + " ")
+
+class StubGenAI(types.ModuleType):
+    """Stands in for google.generativeai: configure, GenerativeModel, embed_content."""
+
+    def __init__(self, latency_ms=800, embed_latency_ms=120, jitter=0.25, failure_rate=0.0, stream_chunks=8):
+        super().__init__("google.generativeai")
+        self.latency_ms, self.embed_latency_ms = latency_ms, embed_latency_ms
+        self.jitter, self.failure_rate, self.stream_chunks = jitter, failure_rate, stream_chunks
+        self.calls = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def wait(self, base_ms):
+        time.sleep(max(0.0, random.gauss(base_ms, base_ms * self.jitter)) / 1000)
+        if random.random() < self.failure_rate: raise RuntimeError("stub: injected upstream failure")
+
+    def reply_text(self):
+        return " ".join(random.choices(WORDS, k=random.randint(25, 60))).capitalize() + "."
+
+    def configure(self, **kwargs):
+        pass
+
+    def GenerativeModel(self, model_name, system_instruction=None, **kwargs):
+        return StubModel(self, model_name, system_instruction)
+
+    def embed_content(self, model, content, **kwargs):
+        with self._lock: self.calls["embed"] += 1
+        self.wait(self.embed_latency_ms)
+        if isinstance(content, list): return {"embedding": [fake_vector(t) for t in content]}
+        return {"embedding": fake_vector(content)}
+
+def fake_vector(text):
+    """Deterministic unit-ish vector per text, so cache hits and similarity behave like real embeddings."""
+    rng = random.Random(hashlib.sha1(text.encode()).digest())
+    return [rng.gauss(0, 1) for _ in range(EMBED_DIM)]
+
+# --- STAND-IN WIRING (must run before `import app`) ---
+
+def install_stand_ins(args):
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ["MONGO_URI"] = args.mongo_uri or "mongodb://mongomock"
+    os.environ["GEMINI_API_KEY"] = "bench"
+    os.environ.setdefault("VECTOR_BACKEND", "local")
+    os.environ.setdefault("PRECOMPUTE_ANALYSIS", "0")
+
+    stub = StubGenAI(args.latency_ms, args.embed_latency_ms, args.jitter, args.failure_rate)
+    google = sys.modules.get("google") or types.ModuleType("google")
+    google.generativeai = stub
+    sys.modules["google"], sys.modules["google.generativeai"] = google, stub
+
+    if not args.mongo_uri:
+        import pymongo
+        import mongomock
+        import mongomock.gridfs
+        mongomock.gridfs.enable_gridfs_integration()
+        patch_mongomock(mongomock.collection.Collection)
+        pymongo.MongoClient = mongomock.MongoClient
+
+    import session_store
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+    else:
+        import fakeredis
+        shared = fakeredis.FakeRedis()
+        session_store.build_redis = lambda *a, **k: shared
+    return stub
+
+def patch_mongomock(collection_cls):
+    """
+    Two mongomock gaps the app runs into:
+    - projections are edited in place while a document is copied, so a module-level projection dict
+      (app.GALAXY_PROJECTION) shared by concurrent requests breaks; every copy gets its own dict.
+    - `$unset` stages of update pipelines (rank_system's reward pipeline) are not executed; they run
+      as the equivalent exclusion `$project`.
+    """
+    copy_only_fields, apply_update_pipeline = collection_cls._copy_only_fields, collection_cls._apply_update_pipeline
+
+    def _copy_only_fields(self, doc, fields, container):
+        return copy_only_fields(self, doc, dict(fields) if isinstance(fields, dict) else fields, container)
+
+    def _apply_update_pipeline(self, existing_document, pipeline, session):
+        stages = []
+        for stage in pipeline:
+            if "$unset" in stage:
+                fields = [stage["$unset"]] if isinstance(stage["$unset"], str) else stage["$unset"]
+                stage = {"$project": {field: 0 for field in fields}}
+            stages.append(stage)
+        return apply_update_pipeline(self, existing_document, stages, session)
+
+    collection_cls._copy_only_fields, collection_cls._apply_update_pipeline = _copy_only_fields, _apply_update_pipeline
+
+def load_app(args):
+    quiet = open(os.devnull, "w") if not args.verbose else None
+    if quiet: os.environ.setdefault("LOG_LEVEL", "ERROR")  # Startup logs go through the app's logger
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        import app as celi
+    import logging
+    logging.getLogger().setLevel(logging.WARNING if args.verbose else logging.ERROR)
+
+    queued = defaultdict(int)
+    if args.run_tasks:
+        celi.celery_app.conf.task_always_eager = True
+    else:
+        def dispatch(task, *task_args): queued[task.name] += 1
+        celi.dispatch = dispatch
+    return celi, queued
+
+# --- SEED ---
+
+def history_size(mean):
+    """Long-tailed: most users have a few weeks of entries, some have years."""
+    return max(1, min(int(random.lognormvariate(0, 0.8) * mean), mean * 8))
+
+def seed(celi, args):
+    from werkzeug.security import generate_password_hash
+    from constellations import group_for
+    from rank_system import RANK_THRESHOLDS
+    password_hash = generate_password_hash("bench")
+    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    users, total = [], 0
+
+    for u in range(args.users):
+        user_id = f"bench-{u}-{random.getrandbits(32):08x}"
+        n = history_size(args.history)
+        start = datetime.now() - timedelta(days=n)
+        docs, groups = [], defaultdict(list)
+        for i in range(n):
+            when = start + timedelta(days=i, minutes=random.randint(0, 600))
+            timestamp, date = str(when.timestamp()), when.strftime("%Y-%m-%d")
+            msg = " ".join(random.choices(WORDS, k=random.randint(15, 150)))
+            group = group_for(i)
+            groups[group].append((timestamp, date))
+            docs.append({
+                "user_id": user_id, "timestamp": timestamp, "date": date, "summary": msg[:50] + "...",
+                "full_message": msg, "reply": "...", "ai_analysis": "Observation: ..." if random.random() < 0.7 else None,
+                "mode": "rant" if random.random() < 0.1 else "journal", "has_media": False, "media_file_id": None,
+                "has_audio": False, "audio_file_id": None, "constellation_name": None, "is_valid_star": True,
+                "embedding": fake_vector(msg) if not args.no_embeddings else None, "embedding_model": celi.EMBED_MODEL,
+                "star_index": i, "constellation_group": group, "updated_at": when.timestamp(), "sync_seq": i + 1
+            })
+        for i in range(0, len(docs), 500): celi.history_col.insert_many(docs[i:i + 500])
+        celi.constellations_col.insert_many([
+            {"user_id": user_id, "group": g, "members": [t for t, _ in stars], "first_date": stars[0][1], "last_date": stars[-1][1],
+             "name": f"The Week of {random.choice(WORDS).title()}" if len(stars) == 7 else None, "updated_at": time.time()}
+            for g, stars in groups.items()])
+        rank_index = random.randint(0, 20)
+        celi.users_col.insert_one({
+            "user_id": user_id, "username": user_id, "password_hash": password_hash, "first_name": "Bench", "last_name": str(u),
+            "aura_color": "#00f2fe", "secret_question": "?", "rank": "Observer III", "rank_index": rank_index, "stardust": 0,
+            "stardust_total": RANK_THRESHOLDS[rank_index],
+            "current_streak": random.randint(0, 30), "star_count": n, "last_reward_date": yesterday, "entry_count": n, "sync_seq": n,
+        })
+        users.append({"user_id": user_id, "timestamps": [d["timestamp"] for d in docs]})
+        total += n
+    return users, total
+
+# --- LOAD ---
+
+def percentile(values, pct):
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ENDPOINTS: sys.exit(f"Unknown endpoint in --mix: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+def call(client, endpoint, user):
+    if endpoint == "process":
+        msg = " ".join(random.choices(WORDS, k=random.randint(15, 80)))
+        return client.post("/api/process", data={"message": msg, "mode": "journal"}, content_type="multipart/form-data")
+    if endpoint == "data": return client.get("/api/data")
+    if endpoint == "galaxy_map": return client.get("/api/galaxy_map")
+    return client.post("/api/star_detail", json={"id": random.choice(user["timestamps"])})
+
+def failed(resp):
+    if resp.status_code >= 400: return True
+    body = resp.get_json(silent=True)
+    return isinstance(body, dict) and ("error" in body or (body.get("reply") or "").startswith("Signal Lost"))
+
+def run_load(celi, users, args):
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    samples, errors = defaultdict(list), defaultdict(int)
+    lock = threading.Lock()
+    counter = iter(range(args.requests + args.warmup))
+
+    def worker():
+        clients = {}
+        while True:
+            with lock: n = next(counter, None)
+            if n is None: return
+            user = random.choice(users)
+            client = clients.get(user["user_id"])
+            if client is None:
+                client = clients[user["user_id"]] = celi.app.test_client()
+                with client.session_transaction() as sess: sess["user_id"] = user["user_id"]
+            endpoint = random.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                bad = failed(call(client, endpoint, user))
+            except Exception:
+                bad = True
+            elapsed = time.perf_counter() - started
+            if n < args.warmup: continue
+            with lock:
+                samples[endpoint].append(elapsed)
+                if bad: errors[endpoint] += 1
+
+    quiet = open(os.devnull, "w") if not args.verbose else None
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.concurrency)]
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        for t in threads: t.start()
+        for t in threads: t.join()
+    wall = time.perf_counter() - started
+
+    results = {}
+    for endpoint in names:
+        lat = samples[endpoint]
+        results[endpoint] = {"count": len(lat), "errors": errors[endpoint], "rps": len(lat) / wall if wall else 0,
+                             "p50_ms": percentile(lat, 50) * 1000, "p95_ms": percentile(lat, 95) * 1000, "p99_ms": percentile(lat, 99) * 1000}
+    return results, wall
+
+# --- REPORT ---
+
+def print_report(results, wall, meta):
+    print(f"\n{meta['requests']} requests, {meta['concurrency']} concurrent, {wall:.1f}s wall | "
+          f"{meta['users']} users / {meta['entries']} entries | stub latency {meta['latency_ms']}ms, failures {meta['failure_rate']:.0%}")
+    print(f"{'endpoint':<12} {'count':>6} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, r in results.items():
+        print(f"{endpoint:<12} {r['count']:>6} {r['errors']:>5} {r['rps']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+
+def compare(results, baseline_path, tolerance):
+    """Returns the endpoints whose p95 regressed beyond `tolerance` against a saved --json run."""
+    with open(baseline_path) as f: baseline = json.load(f)["results"]
+    regressions = []
+    for endpoint, r in results.items():
+        old = baseline.get(endpoint)
+        if not old or not old["p95_ms"]: continue
+        change = r["p95_ms"] / old["p95_ms"] - 1
+        flag = "❌" if change > tolerance else "✅"
+        print(f"{flag} {endpoint:<12} p95 {old['p95_ms']:.1f}ms -> {r['p95_ms']:.1f}ms ({change:+.0%})")
+        if change > tolerance: regressions.append(endpoint)
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline load test of the hot endpoints against local stand-ins.")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--history", type=int, default=300, help="mean entries per user (long-tailed)")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", default="process=1,data=3,galaxy_map=2,star_detail=3", help="endpoint=weight,...")
+    parser.add_argument("--latency-ms", type=float, default=800, help="stub generation latency")
+    parser.add_argument("--embed-latency-ms", type=float, default=120, help="stub embedding latency")
+    parser.add_argument("--jitter", type=float, default=0.25, help="latency stddev as a fraction of the mean")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of upstream calls that raise")
+    parser.add_argument("--no-embeddings", action="store_true", help="seed history without vectors")
+    parser.add_argument("--run-tasks", action="store_true", help="run background jobs inline instead of counting them")
+    parser.add_argument("--mongo-uri", help="use a local mongod instead of mongomock")
+    parser.add_argument("--redis-url", help="use a local redis-server instead of fakeredis")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare p95 against a previous --json file")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--verbose", action="store_true", help="keep the app's own output")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    stub = install_stand_ins(args)
+    celi, queued = load_app(args)
+    seeded = time.time()
+    users, entries = seed(celi, args)
+    print(f"✅ Seeded {len(users)} users / {entries} entries in {time.time() - seeded:.1f}s")
+
+    results, wall = run_load(celi, users, args)
+    meta = {"requests": args.requests, "concurrency": args.concurrency, "users": len(users), "entries": entries,
+            "latency_ms": args.latency_ms, "failure_rate": args.failure_rate}
+    print_report(results, wall, meta)
+    print(f"upstream calls: {dict(stub.calls)} | jobs queued: {dict(queued)}")
+
+    if args.json:
+        with open(args.json, "w") as f: json.dump({"meta": meta, "results": results, "at": datetime.now().isoformat()}, f, indent=2)
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import uuid
+import argparse
+import threading
+import urllib.request
+import urllib.parse
+from http.cookiejar import CookieJar
+
+# ==================================================
+#           /api/process CAPACITY CHECK
+# ==================================================
+# Run the server in each mode, then point this at it:
+#   SERVE_MODE=sync   gunicorn app:app -c gunicorn.conf.py  ->  python capacity_check.py --url ... --label sync
+#   SERVE_MODE=gevent gunicorn app:app -c gunicorn.conf.py  ->  python capacity_check.py --url ... --label gevent
+# Use the same host, WEB_CONCURRENCY and a throwaway test account (every request saves an entry) in both runs.
+# The report is normalized per server core.
+
+def percentile(values, pct):
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def multipart(fields):
+    boundary = uuid.uuid4().hex
+    body = "".join(f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n' for k, v in fields.items())
+    return (body + f"--{boundary}--\r\n").encode(), f"multipart/form-data; boundary={boundary}"
+
+def login(url, username, password):
+    """Returns the session Cookie header for the test account."""
+    jar = CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    opener.open(f"{url}/login", urllib.parse.urlencode({"username": username, "password": password}).encode(), timeout=30)
+    cookie = "; ".join(f"{c.name}={c.value}" for c in jar)
+    if not cookie: sys.exit("❌ Login failed (no session cookie)")
+    return cookie
+
+def run_level(url, cookie, concurrency, duration, message):
+    """Keeps `concurrency` /api/process requests in flight for `duration` seconds."""
+    latencies, errors, lock = [], [0], threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        while time.monotonic() < deadline:
+            body, content_type = multipart({"message": message, "mode": "journal"})
+            req = urllib.request.Request(f"{url}/api/process", data=body, headers={"Content-Type": content_type, "Cookie": cookie})
+            started = time.monotonic()
+            try:
+                with urllib.request.urlopen(req, timeout=180) as resp: resp.read()
+                with lock: latencies.append(time.monotonic() - started)
+            except Exception:
+                with lock: errors[0] += 1
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    started = time.monotonic()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.monotonic() - started
+    return {"concurrency": concurrency, "ok": len(latencies), "errors": errors[0], "rps": len(latencies) / elapsed,
+            "p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "p99": percentile(latencies, 99)}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure concurrent /api/process capacity of a running server.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--username", default=os.environ.get("CAPACITY_USER"))
+    parser.add_argument("--password", default=os.environ.get("CAPACITY_PASSWORD"))
+    parser.add_argument("--levels", default="1,8,32,64,128", help="comma-separated in-flight request counts")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per level")
+    parser.add_argument("--cores", type=int, default=os.cpu_count(), help="CPU cores of the SERVER under test")
+    parser.add_argument("--label", default="", help="serving mode, for the report header")
+    parser.add_argument("--message", default="Capacity check: a calm day, a long walk and a short note about it.")
+    args = parser.parse_args()
+    if not args.username or not args.password: sys.exit("--username/--password (or CAPACITY_USER/CAPACITY_PASSWORD) are required")
+
+    cookie = login(args.url.rstrip("/"), args.username, args.password)
+    print(f"[{args.label or args.url}] {args.cores} server core(s), {args.duration:.0f}s per level")
+    print(f"{'in-flight':>9} {'ok':>6} {'err':>5} {'req/s':>8} {'req/s/core':>10} {'p50':>7} {'p95':>7} {'p99':>7}")
+    for level in [int(x) for x in args.levels.split(",") if x.strip()]:
+        r = run_level(args.url.rstrip("/"), cookie, level, args.duration, args.message)
+        print(f"{r['concurrency']:>9} {r['ok']:>6} {r['errors']:>5} {r['rps']:>8.2f} {r['rps'] / args.cores:>10.2f} "
+              f"{r['p50']:>6.2f}s {r['p95']:>6.2f}s {r['p99']:>6.2f}s")
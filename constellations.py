@@ -0,0 +1,118 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pymongo import ReturnDocument, UpdateOne
+
+# ==================================================
+#           CONSTELLATIONS (MATERIALIZED GROUPS)
+# ==================================================
+
+# One document per (user_id, group): group N holds stars N*7 .. N*7+6 by `star_index`.
+# { user_id, group, members: [timestamps], first_date, last_date, name, updated_at }
+STARS_PER_CONSTELLATION = 7
+
+def group_for(star_index):
+    return star_index // STARS_PER_CONSTELLATION
+
+def allocate_star_indexes(users_col, history_col, user_id, count=1):
+    """Reserves `count` consecutive star ordinals from the user's counter (seeded for accounts that predate it). Returns the first."""
+    users_col.update_one({"user_id": user_id, "entry_count": {"$exists": False}},
+                         {"$set": {"entry_count": history_col.count_documents({"user_id": user_id})}})
+    user = users_col.find_one_and_update({"user_id": user_id}, {"$inc": {"entry_count": count}},
+                                         projection={"entry_count": 1}, return_document=ReturnDocument.AFTER)
+    return user["entry_count"] - count
+
+# --- CHANGE SEQUENCE (galaxy delta cursor) ---
+# users.sync_seq: last reserved value; sync_inflight: reservations whose write has not landed yet;
+# sync_committed: a value every write at or below has landed. Readers only hand out sync_committed.
+SYNC_STALE_AFTER = 60  # A reservation older than this is treated as lost (crashed writer)
+
+def allocate_sync_seq(users_col, user_id, count=1):
+    """
+    Reserves `count` values of the user's change sequence. Returns the first, or None for a missing user.
+    Assigned by MongoDB's $inc, so it is monotonic whichever host's clock stamps the write.
+    Every reservation must be paired with release_sync_seq once its write has landed (see sync_write).
+    """
+    user = users_col.find_one_and_update({"user_id": user_id}, {"$inc": {"sync_seq": count, "sync_inflight": 1},
+                                         "$set": {"sync_inflight_at": time.time()}},
+                                         projection={"sync_seq": 1}, return_document=ReturnDocument.AFTER)
+    return user["sync_seq"] - count + 1 if user else None
+
+def release_sync_seq(users_col, user_id):
+    """Ends a reservation. The last in-flight one out moves sync_committed up to everything reserved so far."""
+    user = users_col.find_one_and_update({"user_id": user_id}, {"$inc": {"sync_inflight": -1}},
+                                         projection={"sync_seq": 1, "sync_inflight": 1}, return_document=ReturnDocument.AFTER)
+    if user is None or user["sync_inflight"] > 0: return
+    # No-op if a new reservation slipped in meanwhile: its own release commits past it
+    users_col.update_one({"user_id": user_id, "sync_seq": user["sync_seq"], "sync_inflight": {"$lte": 0}},
+                         {"$set": {"sync_inflight": 0}, "$max": {"sync_committed": user["sync_seq"]}})
+
+@contextmanager
+def sync_write(users_col, user_id, count=1):
+    """Reserves `count` sequence values for the writes inside the block and releases them afterwards."""
+    first = allocate_sync_seq(users_col, user_id, count)
+    try:
+        yield first
+    finally:
+        if first is not None: release_sync_seq(users_col, user_id)
+
+def committed_sync_seq(users_col, user_id, stale_after=SYNC_STALE_AFTER):
+    """Highest sequence value whose writes have all landed: a galaxy cursor never skips a write still in flight."""
+    user = users_col.find_one({"user_id": user_id}, {"sync_seq": 1, "sync_inflight": 1, "sync_inflight_at": 1, "sync_committed": 1})
+    if not user: return 0
+    if user.get("sync_inflight", 0) <= 0: return user.get("sync_seq", 0)
+    if user.get("sync_inflight_at", 0) < time.time() - stale_after:
+        # Writers that never released: give up on them rather than freezing the cursor
+        users_col.update_one({"user_id": user_id, "sync_seq": user["sync_seq"], "sync_inflight_at": user["sync_inflight_at"]},
+                             {"$set": {"sync_inflight": 0}, "$max": {"sync_committed": user["sync_seq"]}})
+        return user["sync_seq"]
+    return user.get("sync_committed", 0)
+
+def add_star(constellations_col, user_id, star_index, timestamp, date):
+    """Adds a star to its constellation. Returns True when this star completed an unnamed constellation."""
+    if constellations_col is None: return False
+    doc = constellations_col.find_one_and_update(
+        {"user_id": user_id, "group": group_for(star_index)},
+        {"$addToSet": {"members": timestamp}, "$min": {"first_date": date}, "$max": {"last_date": date},
+         "$setOnInsert": {"name": None}, "$set": {"updated_at": time.time()}},
+        projection={"_id": 0, "members": 1, "name": 1},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return len(doc.get("members", [])) >= STARS_PER_CONSTELLATION and not doc.get("name")
+
+def set_name(constellations_col, user_id, group, name):
+    """Names a constellation once. Returns the member timestamps, or None if it was already named."""
+    doc = constellations_col.find_one_and_update(
+        {"user_id": user_id, "group": group, "name": None},
+        {"$set": {"name": name, "updated_at": time.time()}},
+        projection={"_id": 0, "members": 1}
+    )
+    return doc["members"] if doc else None
+
+def constellation_names(constellations_col, user_id, groups=None):
+    """{group: name} for the user's named constellations (optionally only `groups`)."""
+    if constellations_col is None: return {}
+    query = {"user_id": user_id, "name": {"$ne": None}}
+    if groups is not None: query["group"] = {"$in": list(groups)}
+    return {c["group"]: c["name"] for c in constellations_col.find(query, {"_id": 0, "group": 1, "name": 1})}
+
+def rebuild_constellations(constellations_col, user_id, docs):
+    """Materializes constellations for stars saved before the collection existed (docs carry star_index)."""
+    groups = defaultdict(list)
+    for doc in docs:
+        if doc.get("star_index") is not None: groups[group_for(doc["star_index"])].append(doc)
+    ops = []
+    for group, stars in groups.items():
+        dates = [s["date"] for s in stars if s.get("date")]
+        named = next((s["constellation_name"] for s in stars if s.get("constellation_name")), None)
+        update = {"$addToSet": {"members": {"$each": [s["timestamp"] for s in stars]}}, "$set": {"updated_at": time.time()}}
+        if dates: update.update({"$min": {"first_date": min(dates)}, "$max": {"last_date": max(dates)}})
+        update["$setOnInsert"] = {"name": named}
+        ops.append(UpdateOne({"user_id": user_id, "group": group}, update, upsert=True))
+    if ops: constellations_col.bulk_write(ops, ordered=False)
+    return len(ops)
+
+def complete_unnamed(constellations_col, user_id, groups):
+    """Of `groups`, those that hold a full set of stars but have no name yet."""
+    query = {"user_id": user_id, "group": {"$in": list(groups)}, "name": None, f"members.{STARS_PER_CONSTELLATION - 1}": {"$exists": True}}
+    return sorted(d["group"] for d in constellations_col.find(query, {"_id": 0, "group": 1}))
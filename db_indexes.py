@@ -0,0 +1,125 @@
+import os
+import sys
+import logging
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+
+from history_search import TEXT_WEIGHTS
+
+# ==================================================
+#           INDEX MANAGER & QUERY PLAN CHECKS
+# ==================================================
+
+log = logging.getLogger("celi.db_indexes")
+
+# collection -> indexes the app's queries rely on
+REQUIRED_INDEXES = {
+    "users": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        # GridFS garbage collection: is this upload someone's profile picture?
+        IndexModel([("profile_pic", ASCENDING)], name="profile_pic"),
+    ],
+    "history": [
+        # Dashboard, galaxy, star_detail, constellation members: equality on user_id, sort/range/$in on timestamp
+        IndexModel([("user_id", ASCENDING), ("timestamp", ASCENDING)], name="user_timestamp"),
+        # Galaxy incremental sync cursor
+        IndexModel([("user_id", ASCENDING), ("sync_seq", ASCENDING)], name="user_sync_seq"),
+        # Search: keyword ranking scoped by the user_id prefix; mode filter + date range / newest-first browse
+        IndexModel([("user_id", ASCENDING)] + [(f, TEXT) for f in TEXT_WEIGHTS], name="user_text", weights=TEXT_WEIGHTS, default_language="english"),
+        IndexModel([("user_id", ASCENDING), ("mode", ASCENDING), ("timestamp", DESCENDING)], name="user_mode_timestamp"),
+        # precompute_analyses sweep across all users: only entries still waiting for an analysis are indexed
+        IndexModel([("timestamp", ASCENDING)], name="pending_analysis", partialFilterExpression={"ai_analysis": {"$type": "null"}}),
+        # GridFS garbage collection: does any entry still point at this upload?
+        IndexModel([("media_file_id", ASCENDING)], name="media_file_ref"),
+        IndexModel([("audio_file_id", ASCENDING)], name="audio_file_ref"),
+    ],
+    "constellations": [
+        # One document per (user, group): star insert upsert, naming and galaxy name lookups
+        IndexModel([("user_id", ASCENDING), ("group", ASCENDING)], name="user_group_unique", unique=True),
+    ],
+    "fs.files": [
+        # Upload dedup lookup and model-image variant cache; unique so concurrent identical uploads store once
+        IndexModel([("sha256", ASCENDING), ("length", ASCENDING), ("contentType", ASCENDING)], name="upload_hash",
+                   unique=True, partialFilterExpression={"sha256": {"$exists": True}}),
+        IndexModel([("source_id", ASCENDING), ("variant", ASCENDING)], name="source_variant", sparse=True),
+    ],
+}
+
+# name -> (collection, filter, sort) shaped like the hot request-path queries
+PROBE_USER = "__index_probe__"
+HOT_QUERIES = {
+    "login_by_username": ("users", {"username": PROBE_USER}, None),
+    "user_by_id": ("users", {"user_id": PROBE_USER}, None),
+    "dashboard_history": ("history", {"user_id": PROBE_USER}, [("timestamp", ASCENDING)]),
+    "star_detail": ("history", {"user_id": PROBE_USER, "timestamp": "0"}, None),
+    "constellation_members": ("history", {"user_id": PROBE_USER, "timestamp": {"$in": ["0", "1"]}}, None),
+    "constellation_lookup": ("constellations", {"user_id": PROBE_USER, "group": 0}, None),
+    "galaxy_delta": ("history", {"user_id": PROBE_USER, "sync_seq": {"$gt": 0, "$lte": 1}}, [("timestamp", ASCENDING)]),
+    "search_text": ("history", {"user_id": PROBE_USER, "$text": {"$search": "probe"}}, None),
+    "search_mode_range": ("history", {"user_id": PROBE_USER, "mode": "rant", "timestamp": {"$gte": "0"}}, [("timestamp", DESCENDING)]),
+    "pending_analysis": ("history", {"timestamp": {"$gte": "0"}, "ai_analysis": {"$type": "null"}}, None),
+    "upload_dedup": ("fs.files", {"sha256": "0", "length": 0, "contentType": "image/png"}, None),
+    "file_refs": ("history", {"media_file_id": {"$in": [0]}}, None),
+    "pfp_refs": ("users", {"profile_pic": {"$in": ["/api/media/0"]}}, None),
+}
+
+def ensure_indexes(db, collections=None):
+    """
+    Creates any missing required index, one at a time so a failing build (e.g. a unique index over
+    existing duplicates) doesn't hold back the others. Returns {collection: [created index names]}.
+    """
+    created = {}
+    for name, models in REQUIRED_INDEXES.items():
+        if collections and name not in collections: continue
+        col = db[name]
+        existing = col.index_information()
+        existing_keys = {tuple(info["key"]) for info in existing.values()}
+        missing = [m for m in models if m.document["name"] not in existing and tuple(m.document["key"].items()) not in existing_keys]
+        for model in missing:
+            try:
+                created.setdefault(name, []).extend(col.create_indexes([model]))
+            except Exception as e:
+                log.error("index build failed", extra={"collection": name, "index": model.document["name"], "error": str(e)})
+    return created
+
+def _plan_stages(node):
+    """Yields every stage name in an explain() plan tree (classic and SBE layouts)."""
+    if isinstance(node, dict):
+        if "stage" in node: yield node["stage"]
+        for value in node.values():
+            yield from _plan_stages(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _plan_stages(value)
+
+def verify_query_plans(db):
+    """Explains each hot query. Returns {query name: winning plan stages}; flags collection scans."""
+    report = {}
+    for name, (col_name, query, sort) in HOT_QUERIES.items():
+        cursor = db[col_name].find(query).limit(1)
+        if sort: cursor = cursor.sort(sort)
+        try:
+            planner = cursor.explain().get("queryPlanner", {})
+            stages = list(_plan_stages(planner.get("winningPlan", {})))
+        except Exception as e:
+            log.error("query explain failed", extra={"query": name, "error": str(e)})
+            continue
+        report[name] = stages
+        if "COLLSCAN" in stages: log.warning("query plan is a collection scan", extra={"query": name, "collection": col_name})
+    return report
+
+if __name__ == '__main__':
+    # Usage: python db_indexes.py [--verify]
+    import certifi
+    from pymongo import MongoClient
+    from instrumentation import configure_logging
+    configure_logging(os.environ.get('LOG_LEVEL', 'INFO').upper(), os.environ.get('LOG_FORMAT', 'json'))
+    mongo_uri = os.environ.get("MONGO_URI")
+    if not mongo_uri: sys.exit("MONGO_URI is not set")
+    db = MongoClient(mongo_uri, tlsCAFile=certifi.where())['celi_journal_db']
+    for col_name, names in ensure_indexes(db).items():
+        print(f"✅ Built on {col_name}: {', '.join(names)}")
+    if "--verify" in sys.argv:
+        scans = [name for name, stages in verify_query_plans(db).items() if "COLLSCAN" in stages]
+        print("✅ All hot queries use indexes" if not scans else f"❌ Collection scans: {', '.join(scans)}")
+        sys.exit(1 if scans else 0)
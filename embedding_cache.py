@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+# ==================================================
+#           EMBEDDING CACHE (LRU + REDIS)
+# ==================================================
+
+log = logging.getLogger("celi.embedding_cache")
+
+KEY_PREFIX = "celi:emb:"
+INDEX_KEY = "celi:emb:index"  # ZSET of cached keys scored by write time, used to enforce the size cap
+
+def normalize_text(text):
+    """Canonical form used for hashing: NFC, trimmed, whitespace collapsed."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def cache_key(text, model, task_type):
+    digest = hashlib.sha256(f"{model}\x00{task_type}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+    return KEY_PREFIX + digest
+
+def pack_vector(vector):
+    return array('f', vector).tobytes()
+
+def unpack_vector(raw):
+    vec = array('f')
+    vec.frombytes(raw)
+    return vec.tolist()
+
+class EmbeddingCache:
+    """
+    Two-tier cache for embedding vectors.
+    Tier 1: in-process LRU (per worker). Tier 2: shared Redis with TTL and a key cap.
+    Redis errors are swallowed so the cache never breaks the embedding call.
+    """
+
+    def __init__(self, redis_conn=None, local_size=512, ttl=30 * 86400, max_keys=50000):
+        self.redis = redis_conn
+        self.local_size = local_size
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_local = 0
+        self.hits_redis = 0
+        self.misses = 0
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._local[key] = vector
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            vector = self._local.get(key)
+            if vector is not None:
+                self._local.move_to_end(key)
+                self.hits_local += 1
+                return vector
+
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(key)
+                if raw:
+                    vector = unpack_vector(raw)
+                    self._remember(key, vector)
+                    with self._lock: self.hits_redis += 1
+                    return vector
+            except Exception as e:
+                log.warning("embedding cache get failed", extra={"error": str(e)})
+
+        with self._lock: self.misses += 1
+        return None
+
+    def set(self, key, vector):
+        if not vector: return
+        self._remember(key, vector)
+        if self.redis is None: return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.set(key, pack_vector(vector), ex=self.ttl)
+            pipe.zadd(INDEX_KEY, {key: time.time()})
+            pipe.zcard(INDEX_KEY)
+            size = pipe.execute()[-1]
+            if size > self.max_keys:
+                self._trim(size - self.max_keys)
+        except Exception as e:
+            log.warning("embedding cache set failed", extra={"error": str(e)})
+
+    def _trim(self, overflow):
+        """Evicts the oldest Redis entries beyond the key cap."""
+        oldest = self.redis.zpopmin(INDEX_KEY, overflow)
+        if oldest: self.redis.delete(*[k for k, _ in oldest])
+
+    def get_or_compute(self, text, model, task_type, compute):
+        """Returns the cached vector for (text, model, task_type) or calls `compute()` and stores the result."""
+        key = cache_key(text, model, task_type)
+        vector = self.get(key)
+        if vector is None:
+            vector = compute()
+            if vector: self.set(key, vector)
+        return vector
+
+    def stats(self):
+        with self._lock:
+            hits = self.hits_local + self.hits_redis
+            total = hits + self.misses
+            return {
+                "hits_local": self.hits_local,
+                "hits_redis": self.hits_redis,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "local_entries": len(self._local),
+                "local_capacity": self.local_size
+            }
@@ -0,0 +1,36 @@
+import os
+import multiprocessing
+
+# ==================================================
+#           GUNICORN SERVING MODES
+# ==================================================
+# SERVE_MODE=sync (default): one request per worker process.
+# SERVE_MODE=gevent: cooperative workers. A request waiting on Gemini parks its greenlet,
+#   so one process holds `worker_connections` in-flight generations (AI_POOL is sized to match in app.py).
+# Measure both with capacity_check.py on the target host before switching.
+
+SERVE_MODE = os.environ.get("SERVE_MODE", "sync")
+CORES = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+# The app (ssl, pymongo, redis, genai) must be imported AFTER the gevent worker monkey-patches
+preload_app = False
+
+if SERVE_MODE == "gevent":
+    worker_class = "gevent"
+    workers = int(os.environ.get("WEB_CONCURRENCY", CORES))
+    worker_connections = int(os.environ.get("WORKER_CONNECTIONS", 200))
+else:
+    worker_class = "sync"
+    workers = int(os.environ.get("WEB_CONCURRENCY", CORES * 2 + 1))
+
+def when_ready(server):
+    server.log.info(f"Serving mode: {SERVE_MODE} ({workers} workers x {worker_connections if SERVE_MODE == 'gevent' else 1} connections)")
+
+def child_exit(server, worker):
+    # Prometheus multiprocess mode (PROMETHEUS_MULTIPROC_DIR): drop the dead worker's live gauges
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
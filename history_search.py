@@ -0,0 +1,113 @@
+import re
+import json
+import base64
+from datetime import datetime, timedelta
+
+# ==================================================
+#           HISTORY SEARCH (TEXT + DATE + MODE + VECTOR)
+# ==================================================
+
+# Backed by db_indexes: `user_text` ($text with a user_id prefix) and `user_mode_timestamp`
+TEXT_WEIGHTS = {"full_message": 10, "summary": 5, "reply": 1}
+RESULT_PROJECTION = {"_id": 0, "timestamp": 1, "date": 1, "summary": 1, "full_message": 1, "mode": 1, "has_media": 1, "has_audio": 1}
+MODES = ("journal", "rant")
+MAX_LIMIT = 50
+MAX_RANKED = 500  # Deepest page reachable in a ranked (text / hybrid) result list
+RRF_K = 60
+
+def encode_cursor(data):
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode()).decode()
+
+def decode_cursor(token):
+    """Returns the cursor dict, or {} for a missing / malformed token (first page). Ill-typed fields are dropped."""
+    if not token: return {}
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError):
+        return {}
+    if not isinstance(data, dict): return {}
+    cursor = {}
+    if isinstance(data.get("o"), int) and not isinstance(data["o"], bool): cursor["o"] = max(0, data["o"])
+    if isinstance(data.get("t"), str): cursor["t"] = data["t"]
+    return cursor
+
+def day_start(date_str, days=0):
+    """Entry timestamps are str(epoch seconds); a YYYY-MM-DD bound becomes the same representation."""
+    return str((datetime.strptime(date_str, "%Y-%m-%d") + timedelta(days=days)).timestamp())
+
+def build_filter(user_id, date_from=None, date_to=None, mode=None):
+    """Raises ValueError on a malformed date."""
+    query = {"user_id": user_id}
+    bounds = {}
+    if date_from: bounds["$gte"] = day_start(date_from)
+    if date_to: bounds["$lt"] = day_start(date_to, days=1)
+    if bounds: query["timestamp"] = bounds
+    if mode in MODES: query["mode"] = mode
+    return query
+
+def snippet(text, terms, width=160):
+    """Excerpt of `text` around the first matching term (or its start)."""
+    text = text or ""
+    if len(text) <= width: return text
+    lowered = text.lower()
+    hits = [lowered.find(t.lower()) for t in terms if t and lowered.find(t.lower()) >= 0]
+    start = max(0, min(hits) - width // 4) if hits else 0
+    end = min(len(text), start + width)
+    return ("…" if start else "") + text[start:end] + ("…" if end < len(text) else "")
+
+def _row(doc, terms, score=None):
+    return {"id": doc["timestamp"], "date": doc.get("date"), "summary": doc.get("summary", ""), "mode": doc.get("mode", "journal"),
+            "snippet": snippet(doc.get("full_message"), terms), "has_media": doc.get("has_media", False),
+            "has_audio": doc.get("has_audio", False), "score": round(score, 4) if score is not None else None}
+
+def _browse(history_col, query, limit, cursor):
+    """Newest first; keyset pagination on timestamp."""
+    if cursor.get("t"):
+        query["timestamp"] = {**query.get("timestamp", {}), "$lt": cursor["t"]}
+    docs = list(history_col.find(query, RESULT_PROJECTION).sort("timestamp", -1).limit(limit + 1))
+    more = len(docs) > limit
+    docs = docs[:limit]
+    return [_row(d, []) for d in docs], encode_cursor({"t": docs[-1]["timestamp"]}) if more else None
+
+def _text_ranked(history_col, query, text, depth):
+    """[(timestamp, textScore)] best first, from the user-prefixed text index."""
+    cursor = history_col.find({**query, "$text": {"$search": text}}, {"_id": 0, "timestamp": 1, "score": {"$meta": "textScore"}})
+    return [(d["timestamp"], d["score"]) for d in cursor.sort([("score", {"$meta": "textScore"}), ("timestamp", -1)]).limit(depth)]
+
+def _fuse(text_ranked, vector_ranked):
+    """Reciprocal-rank fusion of two best-first lists of timestamps."""
+    scores = {}
+    for ranked in (text_ranked, vector_ranked):
+        for rank, (timestamp, _) in enumerate(ranked):
+            scores[timestamp] = scores.get(timestamp, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))
+
+def search_history(history_col, user_id, text="", date_from=None, date_to=None, mode=None, limit=20, cursor=None, vector_hits=None):
+    """
+    Keyword search (ranked by the weighted text index), optionally fused with vector hits
+    [(timestamp, score)], within a date range and mode. Without keywords or hits it browses newest first.
+    Returns {"results": [...], "next_cursor": token or None}. Raises ValueError on a malformed date.
+    """
+    limit = max(1, min(int(limit or 20), MAX_LIMIT))
+    cursor = decode_cursor(cursor)
+    query = build_filter(user_id, date_from, date_to, mode)
+    text = (text or "").strip()
+    terms = re.findall(r"\w+", text)
+
+    if not text and not vector_hits:
+        results, next_cursor = _browse(history_col, query, limit, cursor)
+        return {"results": results, "next_cursor": next_cursor}
+
+    offset = cursor.get("o", 0)
+    depth = min(offset + limit + 1, MAX_RANKED)
+    ranked = _text_ranked(history_col, query, text, MAX_RANKED if vector_hits else depth) if text else []
+    if vector_hits:
+        # Vector hits ignore the filters; keep only those that pass them
+        allowed = {d["timestamp"] for d in history_col.find({**query, "timestamp": {**query.get("timestamp", {}), "$in": [t for t, _ in vector_hits]}}, {"_id": 0, "timestamp": 1})}
+        ranked = _fuse(ranked, [(t, s) for t, s in vector_hits if t in allowed])
+
+    page = ranked[offset:offset + limit]
+    docs = {d["timestamp"]: d for d in history_col.find({"user_id": user_id, "timestamp": {"$in": [t for t, _ in page]}}, RESULT_PROJECTION)}
+    results = [_row(docs[t], terms, score) for t, score in page if t in docs]
+    more = len(ranked) > offset + limit and offset + limit < MAX_RANKED
+    return {"results": results, "next_cursor": encode_cursor({"o": offset + limit}) if more else None}
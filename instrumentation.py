@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from pymongo import monitoring
+
+try:
+    from prometheus_client import Histogram, CollectorRegistry, generate_latest, multiprocess, REGISTRY, CONTENT_TYPE_LATEST
+except ImportError:  # prometheus_client missing: Server-Timing and logs still work, /metrics says so
+    Histogram = None
+
+# ==================================================
+#           INSTRUMENTATION (PROMETHEUS + SERVER-TIMING)
+# ==================================================
+
+BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+if Histogram:
+    STAGE_SECONDS = Histogram("celi_stage_seconds", "Time per hot-path stage", ["stage"], buckets=BUCKETS)
+    MONGO_SECONDS = Histogram("celi_mongo_command_seconds", "MongoDB / GridFS command latency", ["store", "command"], buckets=BUCKETS)
+    MODEL_SECONDS = Histogram("celi_model_attempt_seconds", "Gemini attempt latency", ["model", "outcome"], buckets=BUCKETS)
+    REQUEST_SECONDS = Histogram("celi_request_seconds", "Request latency", ["endpoint", "method", "status"], buckets=BUCKETS)
+
+_timings = contextvars.ContextVar("celi_stage_timings", default=None)
+
+class StageTimings:
+    """Per-request stage totals; pool jobs started with `propagate` add to the same object."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.totals = {}  # stage -> (seconds, calls)
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            total, calls = self.totals.get(stage, (0.0, 0))
+            self.totals[stage] = (total + seconds, calls + 1)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        with self._lock: items = sorted(self.totals.items())
+        parts = [f'{stage};dur={total * 1000:.1f};desc="{calls}x"' for stage, (total, calls) in items]
+        return ", ".join(parts + [f"total;dur={self.elapsed() * 1000:.1f}"])
+
+    def as_dict(self):
+        with self._lock: return {stage: round(total * 1000, 1) for stage, (total, _) in self.totals.items()}
+
+def begin_request():
+    timings = StageTimings()
+    _timings.set(timings)
+    return timings
+
+def current_timings():
+    return _timings.get()
+
+def observe(stage, seconds):
+    if Histogram: STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = _timings.get()
+    if timings is not None: timings.add(stage, seconds)
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+def propagate(fn):
+    """Binds `fn` to a copy of the caller's context, so a pool thread reports into the submitting request."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+# --- MODEL ATTEMPTS (ModelRouter observer) ---
+
+def model_attempt(name, seconds, ok):
+    if Histogram: MODEL_SECONDS.labels(name, "ok" if ok else "error").observe(seconds)
+    observe("gemini", seconds)
+
+# --- MONGO / GRIDFS (command monitoring) ---
+
+class MongoTimer(monitoring.CommandListener):
+    """Times every command; GridFS is told apart by its fs.files / fs.chunks collections."""
+
+    def __init__(self):
+        self._stores = {}
+
+    def started(self, event):
+        target = event.command.get("collection") if event.command_name == "getMore" else event.command.get(event.command_name)
+        store = "gridfs" if isinstance(target, str) and target.startswith("fs.") else "mongo"
+        self._stores[(event.connection_id, event.request_id)] = store
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        store = self._stores.pop((event.connection_id, event.request_id), "mongo")
+        seconds = event.duration_micros / 1e6
+        if Histogram: MONGO_SECONDS.labels(store, event.command_name).observe(seconds)
+        observe(store, seconds)
+
+# --- REQUESTS & EXPORT ---
+
+def observe_request(endpoint, method, status, seconds):
+    if Histogram: REQUEST_SECONDS.labels(endpoint, method, str(status)).observe(seconds)
+
+def metrics_payload():
+    """(body, content type) for /metrics. Uses the multiprocess collector under PROMETHEUS_MULTIPROC_DIR (gunicorn)."""
+    if not Histogram: return b"# prometheus_client is not installed\n", "text/plain"
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+# --- STRUCTURED LOGGING ---
+
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; `extra={...}` fields become top-level keys."""
+
+    def format(self, record):
+        doc = {"ts": round(record.created, 3), "level": record.levelname, "logger": record.name, "msg": record.getMessage()}
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED: doc[key] = value
+        if record.exc_info: doc["exc"] = self.formatException(record.exc_info)
+        return json.dumps(doc, default=str)
+
+def configure_logging(level="INFO", fmt="json"):
+    """Replaces the root handlers. Library loggers stay at WARNING so DEBUG chatter is never formatted."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    for noisy in ("pymongo", "urllib3", "google", "grpc", "PIL", "celery", "kombu"):
+        logging.getLogger(noisy).setLevel(logging.WARNING)
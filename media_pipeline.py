@@ -0,0 +1,106 @@
+import io
+import logging
+import hashlib
+import tempfile
+from bson.objectid import ObjectId
+from gridfs.errors import FileExists
+
+# ==================================================
+#           UPLOAD PIPELINE (GRIDFS)
+# ==================================================
+
+log = logging.getLogger("celi.media")
+
+READ_CHUNK = 256 * 1024
+SPOOL_BYTES = 1024 * 1024  # Non-retained uploads spill to disk past this size
+
+class UploadTooLarge(Exception):
+    def __init__(self, limit):
+        super().__init__(f"Upload exceeds {limit / (1024 * 1024):g} MB limit")
+        self.limit = limit
+
+def store_upload(fs, upload, filename, max_bytes, keep_bytes=False):
+    """
+    Streams a werkzeug FileStorage into GridFS once, hashing it on the way.
+    Content is addressed by (SHA-256, length, content type): identical uploads resolve to the already
+    stored file. The unique `upload_hash` index (db_indexes) settles concurrent identical uploads: the
+    losing insert removes its chunks and resolves to the winner.
+    With `keep_bytes`, the upload is buffered in memory and its bytes are also returned for the model call;
+    otherwise it is spooled (memory, then disk) so memory stays bounded.
+    Returns (file_id, data_or_None). Raises UploadTooLarge past `max_bytes`.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    spool = io.BytesIO() if keep_bytes else tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    try:
+        while True:
+            chunk = upload.stream.read(READ_CHUNK)
+            if not chunk: break
+            size += len(chunk)
+            if size > max_bytes: raise UploadTooLarge(max_bytes)
+            digest.update(chunk)
+            spool.write(chunk)
+        if not size: return None, None
+
+        data = spool.getvalue() if keep_bytes else None  # Shares the BytesIO buffer, no second copy
+        key = {"sha256": digest.hexdigest(), "length": size, "contentType": upload.mimetype}
+        existing = fs.find_one(key)
+        if existing is not None: return existing._id, data
+
+        spool.seek(0)
+        file_id = ObjectId()
+        try:
+            fs.put(spool, _id=file_id, filename=filename, content_type=upload.mimetype, sha256=key["sha256"])
+        except FileExists:  # GridFS reports any duplicate key on the files document this way; our _id is fresh
+            fs.delete(file_id)  # Chunks are written before the files document: drop ours
+            existing = fs.find_one(key)
+            if existing is None: raise
+            return existing._id, data
+        return file_id, data
+    finally:
+        spool.close()
+
+# ==================================================
+#           MODEL IMAGE PREPROCESSING
+# ==================================================
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow missing: images go to the model as uploaded
+    Image = None
+
+def downscale_image(data, mime, max_side=1024, quality=80):
+    """
+    Fits an image inside `max_side` and re-encodes it as WebP for the model call.
+    Returns (data, mime); the input is returned untouched when it is already small or can't be decoded.
+    """
+    if Image is None or not data: return data, mime
+    try:
+        img = Image.open(io.BytesIO(data))  # Lazy: only the header is parsed here
+        if max(img.size) <= max_side and len(data) <= max_side * max_side: return data, mime
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        if img.mode not in ("RGB", "RGBA"): img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        out = io.BytesIO()
+        img.save(out, format="WEBP", quality=quality, method=4)
+        return out.getvalue(), "image/webp"
+    except Exception as e:
+        log.warning("image preprocess failed", extra={"mime": mime, "error": str(e)})
+        return data, mime
+
+def model_image(fs, file_id, data=None, mime=None, max_side=1024, quality=80):
+    """
+    Returns (data, mime) of the model-ready variant of GridFS image `file_id`.
+    The variant is stored once in GridFS next to the original (which stays untouched for display)
+    and reused by later calls, e.g. the archive analysis.
+    """
+    variant = f"model_{max_side}"
+    cached = fs.find_one({"source_id": file_id, "variant": variant})
+    if cached is not None: return cached.read(), cached.content_type
+    if data is None:
+        grid_out = fs.get(file_id)
+        data, mime = grid_out.read(), grid_out.content_type
+    processed, out_mime = downscale_image(data, mime, max_side, quality)
+    if processed is not data:
+        fs.put(processed, filename=f"{variant}_{file_id}", content_type=out_mime, source_id=file_id, variant=variant)
+    return processed, out_mime
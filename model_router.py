@@ -0,0 +1,161 @@
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# ==================================================
+#           MODEL ROUTER (LATENCY + CIRCUIT BREAKER)
+# ==================================================
+
+log = logging.getLogger("celi.model_router")
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class ModelHealth:
+    """Rolling latency / error window and breaker state for one model."""
+
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)  # (latency_seconds, ok)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.probing = False
+
+    def avg_latency(self):
+        """Mean latency of successful calls; None until one has succeeded."""
+        ok = [lat for lat, success in self.samples if success]
+        return sum(ok) / len(ok) if ok else None
+
+    def error_rate(self):
+        if not self.samples: return 0.0
+        return sum(1 for _, success in self.samples if not success) / len(self.samples)
+
+class ModelRouter:
+    """
+    Shared front for the Gemini candidate lists.
+    - Reuses model clients per (model, system_instruction).
+    - Orders candidates by health tier (proven healthy, untried, erroring, probing), then the caller's preference.
+      Latency only demotes a healthy model that is `slow_factor` times slower than the fastest healthy one.
+    - Opens a breaker after `failure_threshold` consecutive failures, or when the error rate over the
+      window reaches `max_error_rate`; an open model is skipped until `cooldown` passes, then one probe is let through.
+    """
+
+    def __init__(self, model_factory, window=20, failure_threshold=3, max_error_rate=0.5, min_samples=5, cooldown=30, max_clients=64, observer=None,
+                 degraded_error_rate=0.25, slow_factor=3.0):
+        self.model_factory = model_factory
+        self.observer = observer  # Optional callable(name, latency_seconds, ok), e.g. a metrics exporter
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self.degraded_error_rate = degraded_error_rate
+        self.slow_factor = slow_factor
+        self.max_clients = max_clients
+        self._health = {}
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_health(self, name):
+        health = self._health.get(name)
+        if health is None:
+            health = self._health[name] = ModelHealth(self.window)
+        return health
+
+    def model(self, name, system_instruction=None):
+        key = (name, system_instruction)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+        client = self.model_factory(name, system_instruction=system_instruction) if system_instruction else self.model_factory(name)
+        with self._lock:
+            self._clients[key] = client
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        return client
+
+    def _tier(self, health):
+        if health.state == HALF_OPEN: return 3
+        if not health.samples: return 1  # Untried: behind proven models, ahead of failing ones
+        if health.error_rate() >= self.degraded_error_rate or health.avg_latency() is None: return 2
+        return 0
+
+    def order(self, candidates):
+        """
+        Usable candidates, best first: sorted by (tier, slow, error rate, preference), so the configured
+        order decides among equally healthy models. Falls back to the full list if every breaker is open.
+        """
+        now = time.time()
+        usable = []
+        with self._lock:
+            for pref, name in enumerate(candidates):
+                health = self._get_health(name)
+                if health.state == OPEN and now >= health.open_until:
+                    health.state = HALF_OPEN
+                if health.state == OPEN or (health.state == HALF_OPEN and health.probing): continue
+                usable.append((self._tier(health), health.error_rate(), health.avg_latency(), pref, name))
+        if not usable: return list(candidates)
+        fastest = min((lat for tier, _, lat, _, _ in usable if tier == 0), default=None)
+        ranked = []
+        for tier, error_rate, latency, pref, name in usable:
+            slow = tier == 0 and latency > fastest * self.slow_factor
+            ranked.append((tier, slow, error_rate if tier == 2 else 0.0, pref, name))
+        return [name for *_, name in sorted(ranked)]
+
+    @contextmanager
+    def attempt(self, name):
+        """Times one model call and records its outcome; exceptions propagate to the caller's fallback loop."""
+        with self._lock:
+            health = self._get_health(name)
+            if health.state == HALF_OPEN: health.probing = True
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self._record(name, time.perf_counter() - start, False)
+            raise
+        except BaseException:
+            with self._lock: health.probing = False  # Cancelled (e.g. client went away): no verdict
+            raise
+        self._record(name, time.perf_counter() - start, True)
+
+    def _record(self, name, latency, ok):
+        if self.observer:
+            try: self.observer(name, latency, ok)
+            except Exception as e: log.warning("model router observer failed", extra={"error": str(e)})
+        with self._lock:
+            health = self._get_health(name)
+            health.probing = False
+            if ok and health.state != CLOSED: health.samples.clear()  # Recovered: judge it on fresh samples
+            health.samples.append((latency, ok))
+            if ok:
+                health.consecutive_failures = 0
+                health.state = CLOSED
+                return
+            health.consecutive_failures += 1
+            too_many = health.consecutive_failures >= self.failure_threshold
+            too_often = len(health.samples) >= self.min_samples and health.error_rate() >= self.max_error_rate
+            if health.state == HALF_OPEN or too_many or too_often:
+                health.state = OPEN
+                health.open_until = time.time() + self.cooldown
+                log.warning("model breaker open", extra={"model": name, "cooldown": self.cooldown})
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                "models": {
+                    name: {
+                        "state": h.state,
+                        "avg_latency_ms": round(h.avg_latency() * 1000, 1) if h.avg_latency() is not None else None,
+                        "error_rate": round(h.error_rate(), 3),
+                        "samples": len(h.samples),
+                        "consecutive_failures": h.consecutive_failures,
+                        "retry_in_s": round(max(0.0, h.open_until - now), 1) if h.state == OPEN else 0
+                    } for name, h in self._health.items()
+                },
+                "cached_clients": len(self._clients)
+            }
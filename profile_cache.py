@@ -0,0 +1,98 @@
+import json
+import logging
+import time
+import threading
+from collections import OrderedDict
+
+# ==================================================
+#           USER PROFILE CACHE (LRU + REDIS)
+# ==================================================
+
+log = logging.getLogger("celi.profile_cache")
+
+KEY_PREFIX = "celi:profile:"
+
+# Fields the dashboard reads; secrets (password/answer hashes) are never cached
+PROFILE_FIELDS = ("user_id", "username", "first_name", "last_name", "aura_color", "secret_question",
+                  "rank", "rank_index", "stardust", "profile_pic")
+PROFILE_PROJECTION = {"_id": 0, **{f: 1 for f in PROFILE_FIELDS}}
+
+def project_profile(doc):
+    return {f: doc[f] for f in PROFILE_FIELDS if f in doc}
+
+class ProfileCache:
+    """
+    Read-through cache for the projected user document.
+    Tier 1: in-process LRU with a very short TTL (bounds staleness across workers).
+    Tier 2: shared Redis with a short TTL. Writers call `invalidate` (or `put` with the fresh document).
+    Redis errors fall through to Mongo.
+    """
+
+    def __init__(self, redis_conn=None, ttl=60, local_size=1024, local_ttl=3):
+        self.redis = redis_conn
+        self.ttl = ttl
+        self.local_size = local_size
+        self.local_ttl = local_ttl
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_local = 0
+        self.hits_redis = 0
+        self.misses = 0
+
+    def _remember(self, user_id, profile):
+        with self._lock:
+            self._local[user_id] = (time.monotonic() + self.local_ttl, profile)
+            self._local.move_to_end(user_id)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def get(self, user_id, loader):
+        """Returns the cached profile, or calls `loader()` (a projected find_one) and caches its result."""
+        with self._lock:
+            cached = self._local.get(user_id)
+            if cached and cached[0] > time.monotonic():
+                self._local.move_to_end(user_id)
+                self.hits_local += 1
+                return cached[1]
+
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(KEY_PREFIX + user_id)
+                if raw:
+                    profile = json.loads(raw)
+                    self._remember(user_id, profile)
+                    with self._lock: self.hits_redis += 1
+                    return profile
+            except Exception as e:
+                log.warning("profile cache get failed", extra={"error": str(e)})
+
+        with self._lock: self.misses += 1
+        doc = loader()
+        if not doc: return None
+        profile = project_profile(doc)
+        self.put(user_id, profile)
+        return profile
+
+    def put(self, user_id, doc):
+        """Write-through with a freshly returned user document (e.g. from find_one_and_update)."""
+        profile = project_profile(doc)
+        self._remember(user_id, profile)
+        if self.redis is None: return
+        try:
+            self.redis.set(KEY_PREFIX + user_id, json.dumps(profile), ex=self.ttl)
+        except Exception as e:
+            log.warning("profile cache set failed", extra={"error": str(e)})
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._local.pop(user_id, None)
+        if self.redis is None: return
+        try:
+            self.redis.delete(KEY_PREFIX + user_id)
+        except Exception as e:
+            log.warning("profile cache delete failed", extra={"error": str(e)})
+
+    def stats(self):
+        with self._lock:
+            return {"hits_local": self.hits_local, "hits_redis": self.hits_redis, "misses": self.misses,
+                    "local_entries": len(self._local)}
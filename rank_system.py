@@ -1,4 +1,9 @@
+import json
+import hashlib
+from types import MappingProxyType
+from bisect import bisect_right
 from datetime import datetime, timedelta
+from pymongo import ReturnDocument
 
 # ==================================================
 #           ASSET LIBRARY (COLORS & SVGS)
@@ -135,131 +140,134 @@ def check_entry_quality(msg):
         return False
     return True
 
-def process_daily_rewards(users_col, user_id, msg):
+# --- RANK THRESHOLDS ---
+# RANK_THRESHOLDS[i] = total Stardust needed to reach rank i. A user's lifetime total is kept in
+# `stardust_total`; `stardust` is the carried-over progress inside the current rank. Accounts without
+# `stardust_total` derive it as RANK_THRESHOLDS[rank_index] + stardust.
+RANK_THRESHOLDS = [0]
+for _rank in RANK_SYSTEM[:-1]:
+    RANK_THRESHOLDS.append(RANK_THRESHOLDS[-1] + _rank['req'])
+RANK_TITLES = [r['title'] for r in RANK_SYSTEM]
+
+def rank_for_total(total):
+    """Returns (rank_index, stardust within rank) for a lifetime Stardust total."""
+    idx = max(0, bisect_right(RANK_THRESHOLDS, total) - 1)
+    return idx, total - RANK_THRESHOLDS[idx]
+
+BASE_SD = 5
+CONSTELLATION_SIZE = 7
+CONSTELLATION_BONUS = 10
+
+def _reward_pipeline(quality_ok, today_str, yesterday_str):
     """
-    Calculates Daily Rewards, Streaks, and Constellation Bonuses.
-    Returns: { 'awarded': bool, 'total_gain': int, 'message': str, 'event': str }
+    Update pipeline for one entry: daily reward, streak, star count, and every rank-up the new
+    total allows, evaluated server-side against the document's current values.
     """
-    if users_col is None: return {'awarded': False}
-
-    # 1. QUALITY CHECK
-    if not check_entry_quality(msg):
-        return {'awarded': False, 'message': "Entry too short for Stardust."}
+    last_idx = len(RANK_SYSTEM) - 1
+    prev_idx = {"$min": [{"$ifNull": ["$rank_index", 0]}, last_idx]}
+    return [
+        # 1. ELIGIBILITY (quality + not yet rewarded today)
+        {"$set": {
+            "_award": {"$and": [quality_ok, {"$ne": ["$last_reward_date", today_str]}]},
+            "_from_rank": prev_idx,
+        }},
+        # 2. STREAK & STAR COUNT
+        {"$set": {
+            "current_streak": {"$cond": ["$_award",
+                {"$cond": [{"$eq": ["$last_reward_date", yesterday_str]}, {"$add": [{"$ifNull": ["$current_streak", 0]}, 1]}, 1]},
+                {"$ifNull": ["$current_streak", 0]}]},
+            "star_count": {"$add": [{"$ifNull": ["$star_count", 0]}, {"$cond": ["$_award", 1, 0]}]},
+        }},
+        # 3. REWARDS (streak + constellation bonus on every 7th star)
+        {"$set": {
+            "_streak_sd": {"$cond": ["$_award", {"$multiply": [BASE_SD, "$current_streak"]}, 0]},
+            "_bonus_sd": {"$cond": [{"$and": ["$_award", {"$eq": [{"$mod": ["$star_count", CONSTELLATION_SIZE]}, 0]}]}, CONSTELLATION_BONUS, 0]},
+            "last_reward_date": {"$cond": ["$_award", today_str, "$last_reward_date"]},
+        }},
+        # 4. RANK: highest threshold covered by the lifetime total (multi-rank jumps included)
+        {"$set": {"_total": {"$add": [
+            {"$ifNull": ["$stardust_total", {"$add": [{"$arrayElemAt": [RANK_THRESHOLDS, "$_from_rank"]}, {"$ifNull": ["$stardust", 0]}]}]},
+            "$_streak_sd", "$_bonus_sd"]}}},
+        {"$set": {"rank_index": {"$subtract": [
+            {"$size": {"$filter": {"input": RANK_THRESHOLDS, "cond": {"$lte": ["$$this", "$_total"]}}}}, 1]}}},
+        {"$set": {
+            "stardust": {"$subtract": ["$_total", {"$arrayElemAt": [RANK_THRESHOLDS, "$rank_index"]}]},
+            "rank": {"$arrayElemAt": [RANK_TITLES, "$rank_index"]},
+            "stardust_total": "$_total",
+            "last_award": {"awarded": "$_award", "streak_sd": "$_streak_sd", "bonus_sd": "$_bonus_sd", "from_rank": "$_from_rank"},
+        }},
+        {"$unset": ["_award", "_from_rank", "_streak_sd", "_bonus_sd", "_total"]},
+    ]
 
-    user = users_col.find_one({"user_id": user_id})
-    if not user: return {'awarded': False}
+def apply_entry_rewards(users_col, user_id, msg):
+    """
+    Calculates Daily Rewards, Streaks, Constellation Bonuses and Rank Changes in ONE atomic
+    find_one_and_update, so concurrent submits can't double-award or lose updates.
+    Returns: { 'awarded': bool, 'total_gain': int, 'message': str, 'event': str,
+               'level_up': bool, 'ranks_gained': int, 'user': updated document }
+    """
+    if users_col is None: return {'awarded': False, 'level_up': False}
 
-    today_str = datetime.now().strftime("%Y-%m-%d")
-    last_reward = user.get("last_reward_date") 
-    current_streak = user.get("current_streak", 0)
-    current_dust = user.get("stardust", 0)
-    stars_count = user.get("star_count", 0) 
+    # 1. QUALITY CHECK (still runs the update so pending rank-ups are applied)
+    quality_ok = check_entry_quality(msg)
+    now = datetime.now()
+    user = users_col.find_one_and_update(
+        {"user_id": user_id},
+        _reward_pipeline(quality_ok, now.strftime("%Y-%m-%d"), (now - timedelta(days=1)).strftime("%Y-%m-%d")),
+        projection={"_id": 0, "password_hash": 0, "secret_answer_hash": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not user: return {'awarded': False, 'level_up': False}
 
-    # 2. CHECK IF ALREADY REWARDED TODAY
-    if last_reward == today_str:
-        return {'awarded': False, 'message': "Daily reward already claimed."}
+    award = user.get("last_award", {})
+    ranks_gained = user.get("rank_index", 0) - award.get("from_rank", 0)
+    result = {'awarded': bool(award.get("awarded")), 'level_up': ranks_gained > 0, 'ranks_gained': ranks_gained, 'user': user}
 
-    # 3. CALCULATE STREAK
-    yesterday_str = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-    
-    if last_reward == yesterday_str:
-        current_streak += 1
+    # 2. FORMAT FEEDBACK MESSAGE
+    if not quality_ok:
+        result['message'] = "Entry too short for Stardust."
+    elif not result['awarded']:
+        result['message'] = "Daily reward already claimed."
     else:
-        current_streak = 1 # Reset streak if missed a day
+        streak_sd, bonus_sd = award.get("streak_sd", 0), award.get("bonus_sd", 0)
+        result['total_gain'] = streak_sd + bonus_sd
+        result['event'] = "daily_reward"
+        result['message'] = f"+{streak_sd} SD (Streak x{user.get('current_streak', 1)})"
+        if bonus_sd:
+            result['message'] += f"\n+{bonus_sd} SD (Constellation Completed!)"
+            result['event'] = "constellation_complete"
+    return result
 
-    # 4. CALCULATE REWARDS
-    base_sd = 5
-    streak_sd = base_sd * current_streak
-    
-    # 5. CONSTELLATION BONUS (Every 7th Star/Entry)
-    stars_count += 1
-    constellation_bonus = 0
-    is_constellation_complete = (stars_count % 7 == 0)
-    
-    if is_constellation_complete:
-        constellation_bonus = 10
-    
-    total_gain = streak_sd + constellation_bonus
-    new_dust = current_dust + total_gain
-    
-    # 6. UPDATE DB
-    users_col.update_one(
-        {"user_id": user_id},
-        {
-            "$set": {
-                "stardust": new_dust,
-                "current_streak": current_streak,
-                "last_reward_date": today_str,
-                "star_count": stars_count
-            }
-        }
-    )
+# ==================================================
+#           RANK CATALOG (PRECOMPUTED AT IMPORT)
+# ==================================================
 
-    # 7. FORMAT FEEDBACK MESSAGE
-    event_type = "daily_reward"
-    msg_text = f"+{streak_sd} SD (Streak x{current_streak})"
-    
-    if constellation_bonus: 
-        msg_text += f"\n+10 SD (Constellation Completed!)"
-        event_type = "constellation_complete"
+def _enrich(rank):
+    """Injects Assets based on Rank Title Prefix."""
+    r = dict(rank)
+    base_name = r['title'].split(' ')[0]
+    r['svg'] = RANK_ICONS.get(base_name, RANK_ICONS.get('Observer'))
+    r['color'] = PHASE_COLORS.get(base_name, "#00f2fe")
+    return r
 
-    return {
-        'awarded': True, 
-        'total_gain': total_gain, 
-        'message': msg_text,
-        'event': event_type
-    }
+# Read-only views: built once, shared by every request
+RANK_CATALOG = tuple(MappingProxyType(_enrich(rank)) for rank in RANK_SYSTEM)
 
-def update_rank_check(users_col, user_id):
-    """
-    Checks if current stardust is enough to Level Up.
-    Does NOT award XP, just processes Rank Changes.
-    """
-    if users_col is None: return None
-    
-    user = users_col.find_one({"user_id": user_id})
-    current_idx = user.get("rank_index", 0)
-    current_dust = user.get("stardust", 0)
-    
-    rank_data = RANK_SYSTEM[current_idx] if current_idx < len(RANK_SYSTEM) else RANK_SYSTEM[-1]
-    req = rank_data['req']
-    
-    if current_dust >= req and current_idx < len(RANK_SYSTEM) - 1:
-        new_dust = current_dust - req # Carry over overflow
-        current_idx += 1
-        new_rank = RANK_SYSTEM[current_idx]['title']
-        
-        users_col.update_one({"user_id": user_id}, {
-            "$set": {"rank_index": current_idx, "rank": new_rank, "stardust": new_dust}
-        })
-        return "level_up"
-    return None
+# Serialized once for the catalog endpoint; the version changes whenever ranks or assets change
+RANK_CATALOG_JSON = json.dumps(
+    {"ranks": [dict(r) for r in RANK_CATALOG], "lock_icon": RANK_ICONS['Lock']}, separators=(',', ':')
+).encode('utf-8')
+RANK_CATALOG_VERSION = hashlib.sha256(RANK_CATALOG_JSON).hexdigest()[:16]
 
 def get_rank_meta(idx):
-    """Returns the metadata (req, psyche, desc, svg, color) for a given rank index."""
+    """Returns the metadata (req, psyche, desc, svg, color) for a given rank index. Read-only."""
     if idx < 0: idx = 0
-    if idx >= len(RANK_SYSTEM): idx = len(RANK_SYSTEM) - 1
-    
-    data = RANK_SYSTEM[idx].copy()
-    
-    # Inject Assets based on Rank Title Prefix
-    base_name = data['title'].split(' ')[0]
-    data['svg'] = RANK_ICONS.get(base_name, RANK_ICONS.get('Observer'))
-    data['color'] = PHASE_COLORS.get(base_name, "#00f2fe")
-    
-    return data
+    if idx >= len(RANK_CATALOG): idx = len(RANK_CATALOG) - 1
+    return RANK_CATALOG[idx]
 
 def get_all_ranks_data():
     """Returns full rank list with Assets for the Modal."""
-    enriched_list = []
-    for rank in RANK_SYSTEM:
-        r = rank.copy()
-        base_name = r['title'].split(' ')[0]
-        r['svg'] = RANK_ICONS.get(base_name, RANK_ICONS.get('Observer'))
-        r['color'] = PHASE_COLORS.get(base_name, "#00f2fe")
-        enriched_list.append(r)
-    
     return {
-        "ranks": enriched_list,
+        "ranks": [dict(r) for r in RANK_CATALOG],
         "lock_icon": RANK_ICONS['Lock']
     }
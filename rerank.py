@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import argparse
+from collections import Counter
+from pymongo import UpdateOne
+
+from rank_system import RANK_THRESHOLDS, RANK_TITLES, rank_for_total
+
+# ==================================================
+#           BULK RE-RANK (AFTER RANK_SYSTEM CHANGES)
+# ==================================================
+
+PROJECTION = {"_id": 1, "user_id": 1, "rank_index": 1, "stardust": 1, "stardust_total": 1}
+
+def lifetime_total(user):
+    """Lifetime Stardust; derived from the current thresholds for accounts that predate `stardust_total`."""
+    if user.get("stardust_total") is not None: return user["stardust_total"]
+    idx = min(max(user.get("rank_index", 0), 0), len(RANK_THRESHOLDS) - 1)
+    return RANK_THRESHOLDS[idx] + user.get("stardust", 0)
+
+def plan_update(user):
+    """Returns the $set needed to bring `user` in line with RANK_SYSTEM, or None if it is current."""
+    total = lifetime_total(user)
+    idx, dust = rank_for_total(total)
+    if user.get("rank_index") == idx and user.get("stardust") == dust and user.get("stardust_total") == total: return None
+    return {"rank_index": idx, "rank": RANK_TITLES[idx], "stardust": dust, "stardust_total": total}
+
+def rerank_users(users_col, batch_size=1000, dry_run=False, sample_size=10):
+    """
+    Streams users in _id order and rewrites stale rank_index / stardust with unordered bulk_writes.
+    Each write is guarded by the values it was computed from, so a concurrent reward is never overwritten
+    (that user is counted as a conflict; their next entry re-derives the rank from `stardust_total`).
+    """
+    report = {"scanned": 0, "changed": 0, "promoted": 0, "demoted": 0, "written": 0, "conflicts": 0,
+              "rank_moves": Counter(), "samples": []}
+    ops = []
+
+    def flush():
+        if not ops: return
+        if not dry_run:
+            result = users_col.bulk_write(ops, ordered=False)
+            report["written"] += result.modified_count
+            report["conflicts"] += len(ops) - result.matched_count
+        ops.clear()
+
+    for user in users_col.find({}, PROJECTION).sort("_id", 1).batch_size(batch_size):
+        report["scanned"] += 1
+        updates = plan_update(user)
+        if updates is None: continue
+        report["changed"] += 1
+        old_idx = user.get("rank_index", 0)
+        if updates["rank_index"] > old_idx: report["promoted"] += 1
+        elif updates["rank_index"] < old_idx: report["demoted"] += 1
+        report["rank_moves"][updates["rank_index"] - old_idx] += 1
+        if len(report["samples"]) < sample_size:
+            report["samples"].append({"user_id": user.get("user_id"), "from": (old_idx, user.get("stardust", 0)), "to": (updates["rank_index"], updates["stardust"])})
+
+        guard = {"_id": user["_id"], "rank_index": user.get("rank_index"), "stardust": user.get("stardust"), "stardust_total": user.get("stardust_total")}
+        ops.append(UpdateOne(guard, {"$set": updates}))
+        if len(ops) >= batch_size: flush()
+    flush()
+    return report
+
+if __name__ == '__main__':
+    import certifi
+    from pymongo import MongoClient
+    parser = argparse.ArgumentParser(description="Recompute every user's rank from lifetime Stardust after RANK_SYSTEM changes.")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    mongo_uri = os.environ.get("MONGO_URI")
+    if not mongo_uri: sys.exit("MONGO_URI is not set")
+    users_col = MongoClient(mongo_uri, tlsCAFile=certifi.where())['celi_journal_db']['users']
+
+    started = time.time()
+    report = rerank_users(users_col, batch_size=args.batch_size, dry_run=args.dry_run)
+    mode = "DRY RUN" if args.dry_run else "APPLIED"
+    print(f"[{mode}] scanned {report['scanned']} users in {time.time() - started:.1f}s")
+    print(f"  stale: {report['changed']} (promoted {report['promoted']}, demoted {report['demoted']})")
+    if not args.dry_run: print(f"  written: {report['written']}, skipped (changed concurrently): {report['conflicts']}")
+    for delta, count in sorted(report["rank_moves"].items()):
+        print(f"  rank {delta:+d}: {count}")
+    for sample in report["samples"]:
+        print(f"  e.g. {sample['user_id']}: rank {sample['from'][0]} ({sample['from'][1]} SD) -> {sample['to'][0]} ({sample['to'][1]} SD)")
@@ -0,0 +1,137 @@
+import json
+import uuid
+import logging
+import redis
+import msgspec
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import Signer, BadSignature
+
+# ==================================================
+#           SESSION STORE (LAZY REDIS)
+# ==================================================
+
+# Same keys, cookie signing and (msgpack) payloads as Flask-Session 0.8, so sessions issued before the switch stay valid
+KEY_PREFIX = "session:"
+SIGNER_SALT = "flask-session"
+
+log = logging.getLogger("celi.session")
+
+def build_redis(url, max_connections=20, timeout=5, health_check_interval=30):
+    """
+    Redis client on an explicitly sized BlockingConnectionPool: a burst waits up to `timeout` for a free
+    connection instead of opening new TLS connections; idle connections are PINGed before reuse.
+    """
+    kwargs = {"ssl_cert_reqs": None} if url.startswith("rediss://") else {}
+    pool = redis.BlockingConnectionPool.from_url(
+        url, max_connections=max_connections, timeout=timeout, health_check_interval=health_check_interval,
+        socket_keepalive=True, socket_connect_timeout=timeout, socket_timeout=timeout, retry_on_timeout=True, **kwargs)
+    return redis.Redis(connection_pool=pool)
+
+_json_decoder, _msgpack_decoder = msgspec.json.Decoder(), msgspec.msgpack.Decoder()
+
+def decode_session(raw):
+    """JSON (written here) or msgpack (written by Flask-Session). Anything else, pickle included, is an empty session."""
+    if not raw: return {}
+    for decoder in (_json_decoder, _msgpack_decoder):
+        try:
+            data = decoder.decode(raw)
+            return data if isinstance(data, dict) else {}
+        except msgspec.DecodeError:
+            continue
+    return {}
+
+class LazySession(SessionMixin):
+    """Session whose Redis read happens on first use, so routes that never touch `session` cost nothing."""
+
+    def __init__(self, sid=None, loader=None):
+        self.sid = sid
+        self._loader = loader
+        self._data = None if loader else {}
+        self.ttl = None
+        self.new = sid is None
+        self.modified = False
+        self.accessed = False
+
+    def _get(self):
+        self.accessed = True
+        if self._data is None: self._data, self.ttl = self._loader()
+        return self._data
+
+    def __getitem__(self, key): return self._get()[key]
+    def __iter__(self): return iter(self._get())
+    def __len__(self): return len(self._get())
+    def __contains__(self, key): return key in self._get()
+    def get(self, key, default=None): return self._get().get(key, default)
+
+    def __setitem__(self, key, value):
+        self._get()[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self._get()[key]
+        self.modified = True
+
+    def clear(self):
+        if self._get(): self.modified = True
+        self._data.clear()
+
+class LazyRedisSessionInterface(SessionInterface):
+    """
+    Server-side sessions in Redis, read lazily and written only when changed.
+    Unmodified sessions are never rewritten; their TTL is refreshed once half of it has elapsed.
+    """
+
+    def __init__(self, redis_conn, key_prefix=KEY_PREFIX):
+        self.redis = redis_conn
+        self.key_prefix = key_prefix
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=SIGNER_SALT, key_derivation="hmac")
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie: return LazySession()
+        try:
+            sid = self._signer(app).unsign(cookie).decode()
+        except BadSignature:
+            return LazySession()
+        return LazySession(sid, lambda: self._load(sid))
+
+    def _load(self, sid):
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.get(self.key_prefix + sid)
+            pipe.ttl(self.key_prefix + sid)
+            raw, ttl = pipe.execute()
+            return decode_session(raw), ttl
+        except Exception as e:
+            log.warning("session load failed", extra={"error": str(e)})
+            return {}, None
+
+    def save_session(self, app, session, response):
+        if not session.accessed: return  # Never touched: no Redis round-trip, no cookie, no Vary
+        response.vary.add("Cookie")
+        name, domain, path = self.get_cookie_name(app), self.get_cookie_domain(app), self.get_cookie_path(app)
+        lifetime = int(app.permanent_session_lifetime.total_seconds())
+
+        try:
+            if not session.modified:
+                if session.sid and session.ttl is not None and 0 <= session.ttl < lifetime // 2:
+                    self.redis.expire(self.key_prefix + session.sid, lifetime)
+                return
+            if not len(session):
+                if session.sid:
+                    self.redis.delete(self.key_prefix + session.sid)
+                    response.delete_cookie(name, domain=domain, path=path)
+                return
+            sid = session.sid or str(uuid.uuid4())
+            self.redis.set(self.key_prefix + sid, json.dumps(dict(session)), ex=lifetime)
+        except Exception as e:
+            log.warning("session save failed", extra={"error": str(e)})
+            return
+
+        if session.sid is None:
+            session.sid = sid
+            response.set_cookie(name, self._signer(app).sign(sid.encode()).decode(), expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
@@ -1,7 +1,7 @@
 #!/bin/bash
 
-# Start Celery
+# Start Celery (no -B: the periodic sweeps are scheduled by the Procfile `worker` only, so beat never runs twice)
 celery -A app.celery_app worker --loglevel=info &
 
-# Start Gunicorn in Standard Mode (No Gevent)
-exec gunicorn app:app --bind 0.0.0.0:$PORT --timeout 120
+# Start Gunicorn (sync workers by default; SERVE_MODE=gevent for cooperative workers, see gunicorn.conf.py)
+exec gunicorn app:app -c gunicorn.conf.py
@@ -59,15 +59,34 @@ async function sendMessage() {
     formData.append('message', msg); formData.append('mode', currentMode); 
     if(activeMediaFile) formData.append('media', activeMediaFile); 
     if(activeAudioFile) formData.append('audio', activeAudioFile); 
+    if(voidPending) formData.append('void_pending', '1'); 
     
     try { 
-        const res = await fetch('/api/process', { method:'POST', body: formData }); 
-        const data = await res.json(); 
-        document.getElementById('typing-indicator').classList.add('hidden');
-        appendMsg(data.reply, 'ai'); 
-        
-        if(data.command === 'switch_to_void') setTimeout(()=>openChat('rant'), 1500);
-        if(data.command === 'level_up' || data.command === 'daily_reward') loadData(); // Refresh stats
+        // Stream the reply as Server-Sent Events so tokens render as they arrive
+        const res = await fetch('/api/process_stream', { method:'POST', body: formData }); 
+        if(!res.ok || !res.body) {
+            const data = await res.json();
+            document.getElementById('typing-indicator').classList.add('hidden');
+            appendMsg(data.reply, 'ai');
+        } else {
+            const bubble = appendMsg('', 'ai');
+            let data = null;
+            await readEventStream(res, (event, payload) => {
+                if(event === 'token') {
+                    document.getElementById('typing-indicator').classList.add('hidden');
+                    bubble.innerText += payload.text;
+                    document.getElementById('chat-history').scrollTop = 99999;
+                } else if(event === 'done' || event === 'error') {
+                    data = payload;
+                    bubble.innerText = payload.reply;
+                }
+            });
+            document.getElementById('typing-indicator').classList.add('hidden');
+            voidPending = !!(data && data.void_pending);
+            
+            if(data && data.command === 'switch_to_void') setTimeout(()=>openChat('rant'), 1500);
+            if(data && (data.command === 'level_up' || data.command === 'daily_reward')) loadData(); // Refresh stats
+        }
         
         activeMediaFile = null; activeAudioFile = null; 
     } catch(e) { 
@@ -77,12 +96,34 @@ async function sendMessage() {
     isProcessing=false; 
 }
 
+async function readEventStream(res, onEvent) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while(true) {
+        const { done, value } = await reader.read();
+        if(done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let split;
+        while((split = buffer.indexOf('\n\n')) >= 0) {
+            const block = buffer.slice(0, split); buffer = buffer.slice(split + 2);
+            let event = 'message', data = '';
+            block.split('\n').forEach(line => {
+                if(line.startsWith('event: ')) event = line.slice(7);
+                else if(line.startsWith('data: ')) data += line.slice(6);
+            });
+            if(data) onEvent(event, JSON.parse(data));
+        }
+    }
+}
+
 function appendMsg(txt, sender) { 
     const div = document.createElement('div'); 
     div.className = `msg msg-${sender}`; 
     div.innerText = txt; // Simple text for now, markdown if needed
     document.getElementById('chat-history').insertBefore(div, document.getElementById('typing-indicator'));
     document.getElementById('chat-history').scrollTop = 99999;
+    return div;
 }
 
 // Media handlers
@@ -7,6 +7,8 @@ let currentMode = 'journal';
 let activeMediaFile = null; 
 let activeAudioFile = null; 
 let globalRankTree = null; 
+let loadedRankCatalogUrl = null; 
+let voidPending = false; // Echoed back when sessions are cookie-based (server can't update them mid-stream)
 let isGalaxyActive = false;
 
 // --- UTILS ---
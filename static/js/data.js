@@ -5,7 +5,7 @@ async function loadData() {
         if(data.status === 'guest') { window.location.href='/login'; return; } 
         
         // --- DASHBOARD ---
-        globalRankTree = data.progression_tree; 
+        loadRankCatalog(data.rank_catalog_url); 
         document.getElementById('greeting-text').innerText = `Welcome, ${data.first_name}!`; 
         document.getElementById('rank-display').innerText = data.rank; 
         document.getElementById('rank-psyche').innerText = data.rank_psyche; 
@@ -34,6 +34,16 @@ async function loadData() {
     } catch(e) { console.error(e); } 
 }
 
+// Rank tree is static per version: fetched once, then served from the browser cache
+async function loadRankCatalog(url) {
+    if(!url || url === loadedRankCatalogUrl) return;
+    try {
+        const res = await fetch(url); if(!res.ok) return;
+        const catalog = await res.json();
+        globalRankTree = catalog.ranks; loadedRankCatalogUrl = url;
+    } catch(e) { console.error(e); }
+}
+
 function renderCalendar() { 
     const g = document.getElementById('cal-grid'); g.innerHTML=''; 
     const m = currentCalendarDate.getMonth(); const y = currentCalendarDate.getFullYear(); 
@@ -59,3 +69,40 @@ function renderCalendar() {
 function changeMonth(d) { currentCalendarDate.setMonth(currentCalendarDate.getMonth()+d); renderCalendar(); }
 // Auto Load
 window.addEventListener('load', loadData);
+
+// --- ARCHIVE ---
+let archivePollTimer = null;
+
+function openArchive(id) {
+    const modal = document.getElementById('archive-modal');
+    modal.classList.add('active');
+    document.getElementById('archive-analysis').innerText = "Loading...";
+    clearTimeout(archivePollTimer);
+    fetchStarDetail(id, 0, true);
+}
+
+// Analysis is generated in the background: poll while the server reports it pending
+async function fetchStarDetail(id, attempt, renderMedia) {
+    try {
+        const res = await fetch('/api/star_detail', { method:'POST', headers:{'Content-Type':'application/json'}, body:JSON.stringify({id}) });
+        const d = await res.json();
+        if(d.error) { document.getElementById('archive-analysis').innerText = "Analysis corrupted."; return; }
+        document.getElementById('archive-date').innerText = d.date;
+        if(renderMedia) {
+            const imgContainer = document.getElementById('archive-image-container');
+            if(d.image_url) { imgContainer.classList.remove('hidden'); document.getElementById('archive-image').src = d.image_url; }
+            else { imgContainer.classList.add('hidden'); }
+            const audioContainer = document.getElementById('archive-audio-container');
+            if(d.audio_url) { audioContainer.classList.remove('hidden'); document.getElementById('archive-audio').src = d.audio_url; }
+            else { audioContainer.classList.add('hidden'); }
+        }
+        if(d.analysis_status === 'pending') {
+            document.getElementById('archive-analysis').innerText = "Synthesizing...";
+            if(attempt < 20 && document.getElementById('archive-modal').classList.contains('active')) {
+                archivePollTimer = setTimeout(() => fetchStarDetail(id, attempt + 1, false), 1500);
+            }
+            return;
+        }
+        document.getElementById('archive-analysis').innerText = d.analysis || "Analysis corrupted.";
+    } catch(e) { console.error(e); }
+}
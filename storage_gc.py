@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta, timezone
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+
+# ==================================================
+#           ACCOUNT DELETION & GRIDFS GARBAGE COLLECTION
+# ==================================================
+# Uploads are content-addressed (media_pipeline.store_upload): one GridFS file can back entries of several
+# accounts and profile pictures, so a file is removed only once nothing points at it any more.
+# References: history.media_file_id / audio_file_id (ObjectId) and users.profile_pic ("/api/media/<id>").
+# Model-image variants (source_id / variant) live and die with their source file.
+
+BATCH = 500
+MEDIA_URL = "/api/media/"
+MEDIA_FIELDS = ("media_file_id", "audio_file_id")
+SWEEP_CHECKPOINT = "gridfs_sweep"
+
+def pfp_file_id(url):
+    """ObjectId behind a /api/media/<id> profile picture URL; None for external URLs and empty values."""
+    if not isinstance(url, str) or not url.startswith(MEDIA_URL): return None
+    try:
+        return ObjectId(url[len(MEDIA_URL):])
+    except (InvalidId, TypeError):
+        return None
+
+def referenced_ids(db, file_ids):
+    """Subset of `file_ids` an entry or a profile picture still points at (index-backed, see db_indexes)."""
+    file_ids = list(file_ids)
+    if not file_ids: return set()
+    used = set()
+    for field in MEDIA_FIELDS:
+        used.update(db['history'].distinct(field, {field: {"$in": file_ids}}))
+    urls = [MEDIA_URL + str(i) for i in file_ids]
+    used.update(pfp_file_id(u['profile_pic']) for u in db['users'].find({"profile_pic": {"$in": urls}}, {"profile_pic": 1}))
+    return used
+
+def collect_files(db, fs, file_ids):
+    """
+    Deletes those of `file_ids` that nothing references, together with their model-image variants.
+    References are re-checked right before the delete; an upload deduplicated onto the same bytes in that
+    window would lose its file, which is why the sweeper leaves recent files alone. Returns files removed.
+    """
+    candidates = {i for i in file_ids if isinstance(i, ObjectId)}
+    orphans = list(candidates - referenced_ids(db, candidates))
+    if not orphans: return 0
+    variants = [d['_id'] for d in db['fs.files'].find({"source_id": {"$in": orphans}}, {"_id": 1})]
+    for file_id in variants + orphans:
+        fs.delete(file_id)  # files document first, then its chunks
+    return len(variants) + len(orphans)
+
+# --- ACCOUNT DELETION ---
+
+def request_deletion(db, user):
+    """Records the pending deletion (with the profile picture, the user doc is about to go) and removes the user."""
+    db['account_deletions'].update_one({"_id": user['user_id']}, {"$set": {
+        "requested_at": datetime.now(), "pfp_file_id": pfp_file_id(user.get('profile_pic'))}}, upsert=True)
+    db['users'].delete_one({"user_id": user['user_id']})
+
+def delete_account_data(db, fs, user_id, batch_size=BATCH):
+    """
+    Removes a deleted account's history in bounded batches, collecting each batch's GridFS files as it goes.
+    Idempotent: a re-run (or the sweeper's retry) continues with whatever is left. Returns counts.
+    """
+    history_col = db['history']
+    stats = {"entries": 0, "files": 0}
+    while True:
+        docs = list(history_col.find({"user_id": user_id}, {"_id": 1, **{f: 1 for f in MEDIA_FIELDS}}).limit(batch_size))
+        if not docs: break
+        history_col.delete_many({"_id": {"$in": [d['_id'] for d in docs]}})
+        stats["entries"] += len(docs)
+        stats["files"] += collect_files(db, fs, {d.get(f) for d in docs for f in MEDIA_FIELDS})
+    db['constellations'].delete_many({"user_id": user_id})
+    record = db['account_deletions'].find_one({"_id": user_id}) or {}
+    if record.get("pfp_file_id"): stats["files"] += collect_files(db, fs, [record["pfp_file_id"]])
+    db['account_deletions'].delete_one({"_id": user_id})
+    return stats
+
+def stale_deletions(db, older_than):
+    """User ids whose deletion job should have finished by now (lost or crashed worker)."""
+    return [d['_id'] for d in db['account_deletions'].find({"requested_at": {"$lt": datetime.now() - older_than}}, {"_id": 1})]
+
+# --- ORPHAN SWEEPER ---
+
+def sweep_orphans(db, fs, grace=timedelta(hours=24), limit=5000, batch_size=BATCH):
+    """
+    Walks fs.files in _id order, resuming after the previous run (job_checkpoints), and deletes files
+    nothing references plus variants whose source is gone. Files younger than `grace` are skipped:
+    an upload is stored before the entry or profile update that points at it is written.
+    At most `limit` files are examined per run. Returns counts.
+    """
+    files_col, checkpoints = db['fs.files'], db['job_checkpoints']
+    after = (checkpoints.find_one({"_id": SWEEP_CHECKPOINT}) or {}).get("last_id")
+    ceiling = ObjectId.from_datetime(datetime.now(timezone.utc) - grace)  # _id carries the upload time
+    stats = {"scanned": 0, "removed": 0}
+
+    while stats["scanned"] < limit:
+        bounds = {"$lt": ceiling, **({"$gt": after} if after else {})}
+        docs = list(files_col.find({"_id": bounds}, {"_id": 1, "source_id": 1}).sort("_id", 1).limit(batch_size))
+        if not docs:
+            after = None  # End of the collection: the next run starts over
+            break
+        after = docs[-1]['_id']
+        stats["scanned"] += len(docs)
+
+        # Variants first: collecting a source below takes its variants with it
+        variants = [d for d in docs if d.get("source_id")]
+        alive = {d['_id'] for d in files_col.find({"_id": {"$in": [v['source_id'] for v in variants]}}, {"_id": 1})}
+        for v in variants:
+            if v['source_id'] not in alive:
+                fs.delete(v['_id'])
+                stats["removed"] += 1
+        stats["removed"] += collect_files(db, fs, [d['_id'] for d in docs if not d.get("source_id")])
+
+    checkpoints.update_one({"_id": SWEEP_CHECKPOINT}, {"$set": {"last_id": after, "swept_at": datetime.now(), **stats}}, upsert=True)
+    return stats
@@ -0,0 +1,239 @@
+import io
+import json
+import time
+import base64
+import zipfile
+import tempfile
+from types import SimpleNamespace
+from datetime import datetime
+from bson.objectid import ObjectId
+
+from media_pipeline import store_upload, UploadTooLarge
+from constellations import group_for, allocate_star_indexes, sync_write, rebuild_constellations, complete_unnamed
+
+# ==================================================
+#           LOCAL VAULT (STREAMING EXPORT / IMPORT)
+# ==================================================
+# zip:    manifest.json, media/<id> (stored), media.ndjson (file metadata), history.ndjson
+# ndjson: {"type": "manifest"}, then per file {"type": "file"} / {"type": "chunk", "data": b64} / {"type": "file_end"},
+#         then one {"type": "entry"} per history document
+# Files come before entries so an import can remap media ids without buffering history.
+
+VAULT_FORMAT, VAULT_VERSION = "celi-vault", 1
+MEDIA_FIELDS = ("media_file_id", "audio_file_id")
+ENTRY_FIELDS = ("timestamp", "date", "summary", "full_message", "reply", "ai_analysis", "mode", "has_media", "media_file_id",
+                "has_audio", "audio_file_id", "constellation_name", "is_valid_star")
+EXPORT_PROJECTION = {"_id": 0, **{f: 1 for f in ENTRY_FIELDS}}
+PROFILE_FIELDS = ("username", "first_name", "last_name", "aura_color", "rank", "rank_index", "stardust", "stardust_total", "current_streak")
+CHUNK = 256 * 1024
+BATCH = 500
+SPOOL_BYTES = 1024 * 1024
+
+def _dumps(doc):
+    return json.dumps(doc, default=str, ensure_ascii=False)
+
+class _Sink(io.RawIOBase):
+    """Write-only, unseekable buffer the zip is written into; drained after every chunk."""
+
+    def __init__(self):
+        self._parts, self._size, self._pos = [], 0, 0
+
+    def writable(self): return True
+    def tell(self): return self._pos
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._size += len(data)
+        self._pos += len(data)
+        return len(data)
+
+    def pending(self): return self._size
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts, self._size = [], 0
+        return data
+
+# --- EXPORT ---
+
+def _media_ids(history_col, user_id):
+    ids = set()
+    for field in MEDIA_FIELDS:
+        ids.update(str(v) for v in history_col.distinct(field, {"user_id": user_id}) if v)
+    return sorted(ids)
+
+def _grid_files(fs, ids):
+    for file_id in ids:
+        try:
+            grid_out = fs.get(ObjectId(file_id))
+        except Exception:
+            continue  # Missing / malformed reference: the entry is exported without it
+        yield file_id, grid_out, {"id": file_id, "filename": grid_out.filename, "content_type": grid_out.content_type, "length": grid_out.length}
+
+def _manifest(history_col, user):
+    return {"format": VAULT_FORMAT, "version": VAULT_VERSION, "exported_at": datetime.now().isoformat(),
+            "entries": history_col.count_documents({"user_id": user["user_id"]}),
+            "profile": {f: user.get(f) for f in PROFILE_FIELDS}}
+
+def _entries(history_col, user_id):
+    return history_col.find({"user_id": user_id}, EXPORT_PROJECTION).sort("timestamp", 1).batch_size(BATCH)
+
+def export_zip(fs, history_col, user):
+    """Yields a zip archive in ~CHUNK pieces; memory stays at one chunk plus the media id list."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("manifest.json", json.dumps(_manifest(history_col, user), indent=2, default=str))
+        media_index = []
+        for file_id, grid_out, meta in _grid_files(fs, _media_ids(history_col, user["user_id"])):
+            info = zipfile.ZipInfo(f"media/{file_id}", date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED  # Images / audio are already compressed
+            with zf.open(info, "w", force_zip64=True) as dest:
+                for chunk in iter(lambda: grid_out.read(CHUNK), b""):
+                    dest.write(chunk)
+                    yield sink.drain()
+            media_index.append(_dumps(meta))
+        zf.writestr("media.ndjson", "\n".join(media_index))
+        with zf.open("history.ndjson", "w", force_zip64=True) as dest:
+            for doc in _entries(history_col, user["user_id"]):
+                dest.write((_dumps(doc) + "\n").encode())
+                if sink.pending() >= CHUNK: yield sink.drain()
+    yield sink.drain()
+
+def export_ndjson(fs, history_col, user):
+    """Yields the vault as typed JSON lines; media travels as base64 chunks."""
+    yield _dumps({"type": "manifest", **_manifest(history_col, user)}) + "\n"
+    for file_id, grid_out, meta in _grid_files(fs, _media_ids(history_col, user["user_id"])):
+        yield _dumps({"type": "file", **meta}) + "\n"
+        for chunk in iter(lambda: grid_out.read(CHUNK), b""):
+            yield _dumps({"type": "chunk", "id": file_id, "data": base64.b64encode(chunk).decode()}) + "\n"
+        yield _dumps({"type": "file_end", "id": file_id}) + "\n"
+    lines = []
+    for doc in _entries(history_col, user["user_id"]):
+        lines.append(_dumps({"type": "entry", **doc}))
+        if len(lines) >= 200:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines: yield "\n".join(lines) + "\n"
+
+# --- IMPORT ---
+
+def _check_manifest(manifest):
+    if manifest.get("format") != VAULT_FORMAT: raise ValueError("Not a Celi vault")
+    if manifest.get("version", 0) > VAULT_VERSION: raise ValueError(f"Vault version {manifest.get('version')} is newer than this server")
+
+def _zip_records(stream):
+    try:
+        zf = zipfile.ZipFile(stream)
+    except zipfile.BadZipFile as e:
+        raise ValueError(str(e))
+    with zf:
+        with zf.open("manifest.json") as f: _check_manifest(json.load(f))
+        names = set(zf.namelist())
+        if "media.ndjson" in names:
+            with zf.open("media.ndjson") as index:
+                for line in io.TextIOWrapper(index, encoding="utf-8"):
+                    if not line.strip(): continue
+                    meta = json.loads(line)
+                    if f"media/{meta['id']}" not in names: continue
+                    with zf.open(f"media/{meta['id']}") as f: yield "file", meta, f
+        with zf.open("history.ndjson") as history:
+            for line in io.TextIOWrapper(history, encoding="utf-8"):
+                if line.strip(): yield "entry", json.loads(line), None
+
+def _ndjson_records(stream):
+    spool, meta, checked = None, None, False
+    try:
+        for line in io.TextIOWrapper(stream, encoding="utf-8"):
+            if not line.strip(): continue
+            record = json.loads(line)
+            kind = record.pop("type", None)
+            if not checked:
+                if kind != "manifest": raise ValueError("Not a Celi vault")
+                _check_manifest(record)
+                checked = True
+            elif kind == "file":
+                spool, meta = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES), record
+            elif kind == "chunk" and spool is not None:
+                spool.write(base64.b64decode(record["data"]))
+            elif kind == "file_end" and spool is not None:
+                spool.seek(0)
+                yield "file", meta, spool
+                spool.close()
+                spool = None
+            elif kind == "entry":
+                yield "entry", record, None
+    finally:
+        if spool is not None: spool.close()
+
+def _clean_entry(doc, user_id, id_map, keep_names):
+    """Whitelisted fields only; media ids remapped to the re-stored files. None if unusable."""
+    if not isinstance(doc.get("timestamp"), str): return None
+    entry = {f: doc.get(f) for f in ENTRY_FIELDS}
+    entry["user_id"] = user_id
+    entry["mode"] = entry["mode"] if entry["mode"] in ("journal", "rant") else "journal"
+    for field, flag in (("media_file_id", "has_media"), ("audio_file_id", "has_audio")):
+        entry[field] = id_map.get(str(entry[field])) if entry[field] else None
+        entry[flag] = entry[field] is not None
+    if not keep_names: entry["constellation_name"] = None  # Ordinals are re-assigned, so old groupings no longer apply
+    entry.update({"embedding": None, "updated_at": time.time()})  # Vectors: run backfill_embeddings.py
+    return entry
+
+def import_vault(db, fs, user_id, upload, max_file_bytes, on_constellation_complete=None):
+    """
+    Streams a zip or NDJSON vault into the user's account. Media is re-stored through the dedup pipeline,
+    entries go in with insert_many batches; entries whose timestamp already exists are skipped (re-import is safe).
+    `on_constellation_complete(group)` is called for every full, unnamed constellation a batch touched.
+    Returns counts. Raises ValueError for something that isn't a vault.
+    """
+    history_col, users_col, constellations_col = db['history'], db['users'], db['constellations']
+    stream = upload.stream
+    stream.seek(0)
+    is_zip = zipfile.is_zipfile(stream)
+    stream.seek(0)
+    records = _zip_records(stream) if is_zip else _ndjson_records(stream)
+
+    report = {"entries": 0, "skipped": 0, "files": 0, "files_skipped": 0}
+    keep_names = history_col.count_documents({"user_id": user_id}, limit=1) == 0
+    id_map, batch = {}, []
+
+    def flush():
+        if not batch: return
+        existing = {d["timestamp"] for d in history_col.find({"user_id": user_id, "timestamp": {"$in": [e["timestamp"] for e in batch]}}, {"timestamp": 1})}
+        fresh, seen = [], set()
+        for entry in batch:
+            if entry["timestamp"] in existing or entry["timestamp"] in seen: continue
+            seen.add(entry["timestamp"])
+            fresh.append(entry)
+        report["skipped"] += len(batch) - len(fresh)
+        batch.clear()
+        if not fresh: return
+        first = allocate_star_indexes(users_col, history_col, user_id, len(fresh))
+        with sync_write(users_col, user_id, len(fresh)) as first_seq:
+            for offset, entry in enumerate(fresh):
+                entry["star_index"] = first + offset
+                entry["constellation_group"] = group_for(first + offset)
+                entry["sync_seq"] = first_seq + offset
+            history_col.insert_many(fresh, ordered=False)
+        rebuild_constellations(constellations_col, user_id, fresh)
+        report["entries"] += len(fresh)
+        if on_constellation_complete:
+            for group in complete_unnamed(constellations_col, user_id, {e["constellation_group"] for e in fresh}):
+                on_constellation_complete(group)
+
+    for kind, record, fileobj in records:
+        if kind == "file":
+            try:
+                upload_like = SimpleNamespace(stream=fileobj, mimetype=record.get("content_type"))
+                new_id, _ = store_upload(fs, upload_like, record.get("filename") or f"import_{record['id']}", max_file_bytes)
+            except UploadTooLarge:
+                new_id = None
+            if new_id is None: report["files_skipped"] += 1; continue
+            id_map[str(record["id"])] = new_id
+            report["files"] += 1
+        else:
+            entry = _clean_entry(record, user_id, id_map, keep_names)
+            if entry is None: report["skipped"] += 1; continue
+            batch.append(entry)
+            if len(batch) >= BATCH: flush()
+    flush()
+    return report
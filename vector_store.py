@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import logging
+import threading
+import numpy as np
+
+# ==================================================
+#           VECTOR SEARCH BACKENDS (ECHO PROTOCOL)
+# ==================================================
+
+log = logging.getLogger("celi.vector")
+
+MIN_SCORE = 0.65
+MEMORY_FIELDS = ("full_message", "date", "summary")
+
+class AtlasVectorSearch:
+    """Atlas `$vectorSearch` over the `vector_index` search index."""
+
+    def __init__(self, history_col, index_name="vector_index"):
+        self.history_col = history_col
+        self.index_name = index_name
+
+    def search(self, user_id, query_vector, limit=3, min_score=MIN_SCORE):
+        pipeline = [
+            {
+                "$vectorSearch": {
+                    "index": self.index_name,
+                    "path": "embedding",
+                    "queryVector": query_vector,
+                    "numCandidates": 50,
+                    "limit": limit,
+                    "filter": {"user_id": user_id}
+                }
+            },
+            {
+                "$project": {
+                    "_id": 0,
+                    "timestamp": 1,
+                    "full_message": 1,
+                    "date": 1,
+                    "summary": 1,
+                    "score": {"$meta": "vectorSearchScore"}
+                }
+            }
+        ]
+        results = list(self.history_col.aggregate(pipeline))
+        return [r for r in results if r['score'] > min_score]
+
+    def add(self, user_id, entry):
+        pass  # Atlas indexes inserts itself
+
+class LocalVectorIndex:
+    """
+    In-process cosine search for plain MongoDB / local dev.
+    Each user's embeddings live in one contiguous, L2-normalized float32 buffer that grows by doubling,
+    so appending an entry is amortized O(1). Only vectors and timestamps are held; the text of the
+    top hits is read back from MongoDB. Scores use Atlas' cosine normalization, (1 + cos) / 2, so the same cutoff applies.
+    With `persist_dir` set, changed users are written every `persist_interval` seconds by a background
+    thread (never on the request path) as .npy + timestamps, and memory-mapped back after a restart.
+    """
+
+    def __init__(self, history_col, persist_dir=None, ttl=300, max_users=256, persist_interval=60):
+        self.history_col = history_col
+        self.persist_dir = persist_dir
+        self.ttl = ttl
+        self.max_users = max_users
+        self.persist_interval = persist_interval
+        self._users = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        if persist_dir:
+            os.makedirs(persist_dir, exist_ok=True)
+            threading.Thread(target=self._persist_loop, name="vector-index-persist", daemon=True).start()
+
+    # --- Loading ---
+
+    def _fetch(self, user_id, since=None):
+        query = {"user_id": user_id, "embedding": {"$ne": None}}
+        if since: query["timestamp"] = {"$gt": since}
+        vectors, timestamps = [], []
+        for doc in self.history_col.find(query, {"_id": 0, "timestamp": 1, "embedding": 1}).sort("timestamp", 1):
+            vectors.append(doc["embedding"])
+            timestamps.append(doc["timestamp"])
+        return vectors, timestamps
+
+    def _new_entry(self, buffer, size, timestamps):
+        return {"buffer": buffer, "size": size, "timestamps": timestamps,
+                "last_timestamp": timestamps[-1] if timestamps else None, "loaded_at": time.time()}
+
+    def _append(self, entry, vectors, timestamps):
+        """Adds rows in place; the buffer is reallocated (doubling) only when full or memory-mapped."""
+        buffer, size = entry["buffer"], entry["size"]
+        dim = buffer.shape[1] if size else (len(vectors[0]) if vectors else 0)
+        pairs = [(v, t) for v, t in zip(vectors, timestamps) if len(v) == dim]
+        if not pairs: return False
+        rows = normalize_rows([v for v, _ in pairs], dim)
+        need = size + rows.shape[0]
+        if need > buffer.shape[0] or buffer.shape[1] != dim or not buffer.flags.writeable:
+            grown = np.empty((max(need, 2 * buffer.shape[0], 64), dim), dtype=np.float32)
+            if size: grown[:size] = buffer[:size]
+            entry["buffer"] = buffer = grown
+        buffer[size:need] = rows
+        entry["timestamps"].extend(t for _, t in pairs)
+        entry["size"] = need  # Published last: a concurrent search only ever sees complete rows
+        entry["last_timestamp"] = entry["timestamps"][-1]
+        return True
+
+    def _load(self, user_id):
+        entry = self._from_disk(user_id)
+        if entry is None: entry = self._new_entry(np.zeros((0, 0), dtype=np.float32), 0, [])
+        vectors, timestamps = self._fetch(user_id, since=entry["last_timestamp"])
+        if self._append(entry, vectors, timestamps) and self.persist_dir:
+            with self._lock: self._dirty.add(user_id)
+        return entry
+
+    def _entry(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+        if entry is None or time.time() - entry["loaded_at"] > self.ttl:
+            if entry is not None: self._drop_disk(user_id)  # Full reload picks up backfilled vectors
+            entry = self._load(user_id)
+            with self._lock:
+                self._users[user_id] = entry
+                while len(self._users) > self.max_users:
+                    self._users.pop(next(iter(self._users)))
+        return entry
+
+    # --- Query & Update ---
+
+    def search(self, user_id, query_vector, limit=3, min_score=MIN_SCORE):
+        entry = self._entry(user_id)
+        with self._lock:
+            matrix, timestamps = entry["buffer"][:entry["size"]], entry["timestamps"]
+        if not matrix.shape[0]: return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        if query.shape[0] != matrix.shape[1]: return []
+        norm = np.linalg.norm(query)
+        if not norm: return []
+        scores = (1.0 + matrix @ (query / norm)) / 2.0
+        k = min(limit, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        hits = [(timestamps[i], float(scores[i])) for i in top if scores[i] > min_score]
+        if not hits: return []
+        projection = {"_id": 0, "timestamp": 1, **{f: 1 for f in MEMORY_FIELDS}}
+        docs = {d["timestamp"]: d for d in self.history_col.find({"user_id": user_id, "timestamp": {"$in": [t for t, _ in hits]}}, projection)}
+        return [{**docs[t], "score": score} for t, score in hits if t in docs]
+
+    def add(self, user_id, entry_doc):
+        """Appends a freshly inserted history document to a loaded user's buffer."""
+        vector = entry_doc.get("embedding")
+        if not vector: return
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None: return  # Loaded lazily on next search
+            if self._append(entry, [vector], [entry_doc.get("timestamp")]) and self.persist_dir: self._dirty.add(user_id)
+
+    # --- Persistence (background, memory-mapped) ---
+
+    def _paths(self, user_id):
+        safe = "".join(c for c in str(user_id) if c.isalnum() or c in "-_")
+        return os.path.join(self.persist_dir, f"{safe}.npy"), os.path.join(self.persist_dir, f"{safe}.json")
+
+    def _persist_loop(self):
+        while True:
+            time.sleep(self.persist_interval)
+            self.flush()
+
+    def flush(self):
+        """Writes every user changed since the last flush. Vectors and timestamps only, never entry text."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            snapshots = [(u, self._users[u]["buffer"][:self._users[u]["size"]], list(self._users[u]["timestamps"])) for u in dirty if u in self._users]
+        for user_id, matrix, timestamps in snapshots:
+            try:
+                npy_path, meta_path = self._paths(user_id)
+                np.save(npy_path + ".tmp.npy", matrix)
+                os.replace(npy_path + ".tmp.npy", npy_path)
+                with open(meta_path + ".tmp", "w") as f:
+                    json.dump({"timestamps": timestamps}, f)
+                os.replace(meta_path + ".tmp", meta_path)
+            except Exception as e:
+                log.warning("vector index persist failed", extra={"user_id": user_id, "error": str(e)})
+
+    def _from_disk(self, user_id):
+        if not self.persist_dir: return None
+        npy_path, meta_path = self._paths(user_id)
+        try:
+            if not (os.path.exists(npy_path) and os.path.exists(meta_path)): return None
+            with open(meta_path) as f: meta = json.load(f)
+            if "timestamps" not in meta:  # Older layout that also held entry text: discard it
+                self._drop_disk(user_id)
+                return None
+            matrix = np.load(npy_path, mmap_mode="r")
+            if matrix.shape[0] != len(meta["timestamps"]): return None
+            return self._new_entry(matrix, matrix.shape[0], meta["timestamps"])
+        except Exception as e:
+            log.warning("vector index load failed", extra={"user_id": user_id, "error": str(e)})
+            return None
+
+    def _drop_disk(self, user_id):
+        if not self.persist_dir: return
+        for path in self._paths(user_id):
+            try: os.remove(path)
+            except OSError: pass
+
+class AutoVectorSearch:
+    """Uses Atlas when available; falls back to the local index and retries Atlas after a cooldown."""
+
+    def __init__(self, atlas, local, cooldown=300):
+        self.atlas = atlas
+        self.local = local
+        self.cooldown = cooldown
+        self._atlas_down_until = 0
+
+    def search(self, user_id, query_vector, limit=3, min_score=MIN_SCORE):
+        if time.time() >= self._atlas_down_until:
+            try:
+                return self.atlas.search(user_id, query_vector, limit, min_score)
+            except Exception as e:
+                log.warning("atlas vector search failed, using local index", extra={"error": str(e)})
+                self._atlas_down_until = time.time() + self.cooldown
+        return self.local.search(user_id, query_vector, limit, min_score)
+
+    def add(self, user_id, entry):
+        self.local.add(user_id, entry)
+
+def normalize_rows(vectors, dim):
+    if not vectors: return np.zeros((0, dim), dtype=np.float32)
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def build_vector_search(history_col, backend="auto", persist_dir=None):
+    """Factory for the VECTOR_BACKEND setting: 'atlas', 'local' or 'auto'."""
+    if backend == "atlas": return AtlasVectorSearch(history_col)
+    local = LocalVectorIndex(history_col, persist_dir=persist_dir)
+    if backend == "local": return local
+    return AutoVectorSearch(AtlasVectorSearch(history_col), local)